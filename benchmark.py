@@ -0,0 +1,292 @@
+from remonsterate.remonsterate import (
+    MonsterSpriteObject, RemonsterSession, remonsterate, deinterleave_tiles,
+    interleave_tiles, TABLES_DIRECTORY, VERSION)
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from io import BytesIO, StringIO
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from PIL import Image
+import json
+import os
+import random
+import sys
+
+# Builds a synthetic ROM with the same table addresses and counts as
+# tables_list.txt, and a synthetic sprite pack, then times the tile codec,
+# load_image, select_image, write_data and a whole remonsterate() run.
+# No real ROM is needed, so results can be compared from commit to commit.
+
+ROM_SIZE = 0x300000
+TAGS = ['a', 'b', 'c', 'd', 'e']
+
+
+def read_tables_list(tables_list='tables_list.txt'):
+    # Returns ({class name: (pointer, count, record size)}, {address name:
+    # address}, patch filename).
+    tables, addresses, patch = {}, {}, None
+    for line in open(os.path.join(TABLES_DIRECTORY, tables_list)):
+        line = line.split()
+        if not line:
+            continue
+        if line[0].startswith('$'):
+            addresses[line[0][1:]] = int(line[1], 0x10)
+        elif line[0] == '.patch':
+            patch = line[1]
+        else:
+            name, table_filename, pointer, count = line
+            size = 0
+            for field in open(os.path.join(TABLES_DIRECTORY, table_filename)):
+                field = field.strip().split(',')
+                if len(field) < 2:
+                    continue
+                if 'x' in field[1]:
+                    number, width = field[1].split('x')
+                    size += int(number) * int(width)
+                else:
+                    size += int(field[1])
+            tables[name] = (int(pointer, 0x10), int(count), size)
+    return tables, addresses, patch
+
+
+def read_patch_validation(patch_filename):
+    # The bytes an unpatched ROM must already contain for the patch to be
+    # applied.
+    validation = {}
+    address = None
+    in_validation = False
+    for line in open(os.path.join(TABLES_DIRECTORY, patch_filename)):
+        line = line.split('#')[0].rstrip()
+        if line.strip() == 'VALIDATION':
+            in_validation = True
+            continue
+        if not in_validation or not line.strip():
+            continue
+        if ':' in line:
+            label, line = line.split(':', 1)
+            if label.strip():
+                address = int(label, 0x10)
+        data = bytes([int(v, 0x10) for v in line.split()])
+        validation[address] = validation.get(address, b'') + data
+        address += len(data)
+    return validation
+
+
+def make_rom(seed=0):
+    rng = random.Random(seed)
+    tables, addresses, patch = read_tables_list()
+    rom = bytearray(rng.getrandbits(8 * ROM_SIZE).to_bytes(ROM_SIZE,
+                                                            'little'))
+
+    pointer, count, size = tables['MonsterPaletteObject']
+    for i in range(count * size // 2):
+        color = rng.randrange(0x8000)
+        rom[pointer+(i*2):pointer+(i*2)+2] = color.to_bytes(2, 'little')
+
+    comp8_count = tables['MonsterComp8Object'][1]
+    comp16_count = tables['MonsterComp16Object'][1]
+    graphics_size = (addresses['end_monster_graphics']
+                     - addresses['monster_graphics'])
+    pointer, count, size = tables['MonsterSpriteObject']
+    for i in range(count):
+        is_8color = rng.random() < 0.5
+        is_big = rng.random() < 0.2
+        graphics = rng.randrange(0, (graphics_size - 0x2000) // 8)
+        palette = rng.randrange(0x2ff)
+        stencil = rng.randrange(comp16_count if is_big else comp8_count)
+        data = [graphics & 0xff,
+                (graphics >> 8) | (0x80 if is_8color else 0),
+                (palette >> 8) | (0x80 if is_big else 0),
+                palette & 0xff, stencil]
+        rom[pointer+(i*size):pointer+(i*size)+len(data)] = bytes(data)
+
+    for address, data in read_patch_validation(patch).items():
+        if address + len(data) <= len(rom):
+            rom[address:address+len(data)] = data
+
+    return bytes(rom)
+
+
+def make_image(rng, width, height, num_colors):
+    image = Image.new('P', (width, height))
+    palette = [rng.randrange(0x100) for _ in range(3 * num_colors)]
+    image.putpalette(palette + ([0] * (0x300 - len(palette))))
+    pixels = bytearray(width * height)
+    for y in range(height // 8, height):
+        for x in range(width // 8, width - (width // 8)):
+            pixels[(y*width)+x] = rng.randrange(1, num_colors)
+    image.putdata(pixels)
+    return image
+
+
+def make_pack(directory, num_images, seed=0, colors=(4, 8, 16),
+              sizes=(16, 32, 48, 64, 96, 128)):
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    lines = []
+    for i in range(num_images):
+        image = make_image(rng, rng.choice(sizes), rng.choice(sizes),
+                           rng.choice(colors))
+        filename = os.path.join(directory, 'sprite%05d.png' % i)
+        image.save(filename)
+        tags = rng.sample(TAGS, rng.randrange(3))
+        lines.append('{0}:{1}'.format(filename, ','.join(tags)))
+    images_filename = os.path.join(directory, 'images.txt')
+    with open(images_filename, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return images_filename
+
+
+def timed(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        function()
+        times.append(perf_counter() - start)
+    return times
+
+
+def summarize(times, count=1):
+    return {'runs': len(times),
+            'count': count,
+            'min': min(times),
+            'median': median(times),
+            'max': max(times)}
+
+
+def bench_codec(repeat, num_tiles=0x1000, seed=0):
+    rng = random.Random(seed)
+    results = {}
+    for is_8color in (True, False):
+        numbytes = 24 if is_8color else 32
+        data = bytes(rng.getrandbits(8) for _ in range(num_tiles * numbytes))
+        pixels = deinterleave_tiles(data, is_8color)
+        name = '8color' if is_8color else '16color'
+        results['codec_deinterleave_' + name] = summarize(
+            timed(lambda: deinterleave_tiles(data, is_8color), repeat),
+            num_tiles)
+        results['codec_interleave_' + name] = summarize(
+            timed(lambda: interleave_tiles(pixels, is_8color), repeat),
+            num_tiles)
+    return results
+
+
+def bench_load_image(rom, images_filename, repeat):
+    session = RemonsterSession.from_files(images_filename)
+    times = []
+    for _ in range(repeat):
+        session.begin(BytesIO(), 1, rom_type='1.0', source=rom)
+        mso = [mso for mso in MonsterSpriteObject.every
+               if not mso.is_protected][0]
+        start = perf_counter()
+        for image in session.images:
+            mso.load_image(image)
+        times.append(perf_counter() - start)
+        session.close()
+    return {'load_image': summarize(times, len(session.images))}
+
+
+def bench_select_write(rom, images_filename, repeat):
+    # select_image and write_data over every monster of an in-memory run,
+    # in the order a run uses: select_images shuffles the monsters with
+    # the RNG seeded by begin, so every commit times the same selections.
+    # The run is then discarded.
+    session = RemonsterSession.from_files(images_filename)
+    select_times, write_times = [], []
+    for seed in range(repeat):
+        session.begin(BytesIO(), seed, rom_type='1.0', source=rom)
+        try:
+            session.apply_monster_tags()
+            count = len(MonsterSpriteObject.every)
+            start = perf_counter()
+            session.select_images()
+            select_times.append(perf_counter() - start)
+
+            MonsterSpriteObject.pack_graphics()
+            start = perf_counter()
+            for mso in MonsterSpriteObject.every:
+                mso.write_data(session.outfile)
+            write_times.append(perf_counter() - start)
+        finally:
+            session.close()
+    return {'select_image': summarize(select_times, count),
+            'write_data': summarize(write_times, count)}
+
+
+def bench_run(rom, images_filename, repeat):
+    # The phase timings of whole in-memory runs, and end_to_end, which is
+    # remonsterate() on a ROM file.
+    session = RemonsterSession.from_files(images_filename)
+    phases = {}
+    for seed in range(repeat):
+        manifest = session.run(BytesIO(), seed, rom_type='1.0', source=rom,
+                               log=False)
+        for phase, seconds in manifest['timings'].items():
+            phases.setdefault(phase, []).append(seconds)
+
+    results = {}
+    for phase, times in sorted(phases.items()):
+        results['phase_' + phase] = summarize(times)
+
+    times = []
+    for seed in range(repeat):
+        with open('benchmark.smc', 'wb') as f:
+            f.write(rom)
+        start = perf_counter()
+        remonsterate('benchmark.smc', seed, images_filename, rom_type='1.0')
+        times.append(perf_counter() - start)
+    results['end_to_end'] = summarize(times)
+    return results
+
+
+def main():
+    parser = ArgumentParser(description='Benchmark remonsterate.')
+    parser.add_argument('--images', type=int, default=500,
+                        help='number of sprites in the synthetic pack')
+    parser.add_argument('--colors', default='4,8,16',
+                        help='palette sizes of the synthetic sprites')
+    parser.add_argument('--sizes', default='16,32,48,64,96,128',
+                        help='widths and heights of the synthetic sprites')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the results here')
+    args = parser.parse_args()
+
+    colors = [int(c) for c in args.colors.split(',')]
+    sizes = [int(s) for s in args.sizes.split(',')]
+    rom = make_rom(args.seed)
+    results = {}
+    workdir = os.getcwd()
+    with TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            images_filename = make_pack('pack', args.images, seed=args.seed,
+                                        colors=colors, sizes=sizes)
+            results.update(bench_codec(args.repeat, seed=args.seed))
+            with redirect_stdout(StringIO()):
+                results.update(bench_load_image(rom, images_filename,
+                                                args.repeat))
+                results.update(bench_select_write(rom, images_filename,
+                                                  args.repeat))
+                results.update(bench_run(rom, images_filename, args.repeat))
+        finally:
+            os.chdir(workdir)
+
+    report = {
+        'version': VERSION,
+        'python': sys.version.split()[0],
+        'parameters': {'images': args.images, 'colors': colors,
+                       'sizes': sizes, 'repeat': args.repeat,
+                       'seed': args.seed},
+        'results': results,
+        }
+    report = json.dumps(report, indent=1, sort_keys=True)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -4,14 +4,46 @@ from .randomtools.tablereader import (
     get_open_file, close_file, TableObject, addresses, write_patches)
 from .randomtools.utils import cached_property, utilrandom as random
 from .randomtools.interface import get_outfile, set_seed, get_seed
+from .randomtools import tablereader
 from collections import Counter
-from hashlib import md5
+from contextlib import contextmanager, redirect_stdout
+from hashlib import md5, sha1
+from io import BytesIO, StringIO
+from multiprocessing import Pool
 from PIL import Image
 from math import ceil
+from threading import RLock
+from time import time
+import json
+import mmap
+import os
+import pickle
 
 
 VERSION = '5.3'
-ALL_OBJECTS = None
+
+# Set to True to verify every tile conversion with a full round trip.
+DEBUG = False
+
+# SNES bitplane bytes spread out so that each bit lands in the lowest bit
+# of its own byte, most significant bit first. OR-ing together one spread
+# value per bitplane (shifted by plane number) gives a whole row of pixels.
+BITPLANE_SPREAD = [sum([1 << (8*j) for j in range(8) if v & (1 << j)])
+                   for v in range(0x100)]
+BITPLANE_GATHER = {s: v for (v, s) in enumerate(BITPLANE_SPREAD)}
+PLANE_MASK = 0x0101010101010101
+
+# Conversions between 8-bit RGB channels and the 5-bit channels of SNES
+# colors, with the same rounding the float conversions always had.
+RGB_TO_5BIT = bytes([int(round((0x1f / 0xff) * v)) for v in range(0x100)])
+FIVE_BIT_TO_RGB = bytes([int(round((0xff / 0x1f) * v)) for v in range(0x20)])
+
+EXHIROM_SIZE = 0x600000
+HEADER_BLOCK_SIZE = 0x10000
+HEADER_MIRROR = 0x400000
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+TABLES_DIRECTORY = os.path.join(os.path.dirname(__file__), 'tables')
 
 
 def sig_func(c):
@@ -25,6 +57,1131 @@ def reseed(s):
     random.seed(value)
 
 
+def deinterleave_tiles(data, is_8color):
+    # Decodes a block of 3bpp or 4bpp SNES tiles into 64 bytes per tile,
+    # one palette index per pixel, left to right and top to bottom.
+    numbytes = 24 if is_8color else 32
+    spread = BITPLANE_SPREAD
+    pixels = bytearray()
+    for t in range(0, len(data) - (len(data) % numbytes), numbytes):
+        for i in range(8):
+            a = t + (i*2)
+            row = spread[data[a]] | (spread[data[a+1]] << 1)
+            if is_8color:
+                row |= spread[data[t+16+i]] << 2
+            else:
+                row |= ((spread[data[a+16]] << 2) |
+                        (spread[data[a+17]] << 3))
+            pixels += row.to_bytes(8, byteorder='big')
+
+    if DEBUG:
+        assert len(pixels) == (len(data) // numbytes) * 64
+        assert max(pixels, default=0) <= (7 if is_8color else 0xf)
+        old_bitcount = sum([bin(v).count('1') for v in data])
+        new_bitcount = sum([bin(v).count('1') for v in pixels])
+        assert old_bitcount == new_bitcount
+    return bytes(pixels)
+
+
+def interleave_tiles(pixels, is_8color):
+    # The inverse of deinterleave_tiles.
+    numbytes = 24 if is_8color else 32
+    gather = BITPLANE_GATHER
+    assert not len(pixels) % 64
+    data = bytearray(len(pixels) // 64 * numbytes)
+    for (n, p) in enumerate(range(0, len(pixels), 64)):
+        t = n * numbytes
+        for i in range(8):
+            k = p + (i*8)
+            row = int.from_bytes(pixels[k:k+8], byteorder='big')
+            a = t + (i*2)
+            data[a] = gather[row & PLANE_MASK]
+            data[a+1] = gather[(row >> 1) & PLANE_MASK]
+            if is_8color:
+                data[t+16+i] = gather[(row >> 2) & PLANE_MASK]
+            else:
+                data[a+16] = gather[(row >> 2) & PLANE_MASK]
+                data[a+17] = gather[(row >> 3) & PLANE_MASK]
+    data = bytes(data)
+
+    if DEBUG:
+        assert deinterleave_tiles(data, is_8color) == bytes(pixels)
+    return data
+
+
+class Tile:
+    # One decoded 8x8 tile, immutable, as 64 bytes with one palette index
+    # per pixel. Indexing and iterating give rows as lists of ints, so a
+    # Tile can stand in for the lists of lists tiles used to be, and it
+    # compares equal to one. The hash is cached, for sets and dicts of tiles.
+    __slots__ = ['pixels', '_hash']
+
+    def __init__(self, pixels):
+        pixels = bytes(pixels)
+        assert len(pixels) == 64
+        self.pixels = pixels
+        self._hash = None
+
+    def __repr__(self):
+        return 'Tile({0})'.format(self.pixels.hex())
+
+    def __len__(self):
+        return 8
+
+    def __getitem__(self, index):
+        return self.rows[index]
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    @property
+    def rows(self):
+        return [list(self.pixels[i:i+8]) for i in range(0, 64, 8)]
+
+    def __eq__(self, other):
+        if isinstance(other, Tile):
+            return self.pixels == other.pixels
+        if isinstance(other, list):
+            return self.rows == other
+        return NotImplemented
+
+    def __hash__(self):
+        if self._hash is None:
+            self._hash = hash(self.pixels)
+        return self._hash
+
+
+def tiles_to_pixels(tiles):
+    return b''.join([tile.pixels if isinstance(tile, Tile)
+                     else bytes([v for row in tile for v in row])
+                     for tile in tiles])
+
+
+def pixels_to_tiles(pixels):
+    return [Tile(pixels[t:t+64]) for t in range(0, len(pixels), 64)]
+
+
+# Palettes are kept as 15-bit colors, which is what is read and written,
+# so nothing is converted at table load or write time. These run only for
+# the palettes of monsters that get or keep a sprite, one palette at a time.
+def colors_to_rgb(colors):
+    # 15-bit SNES colors to (r, g, b) tuples.
+    assert not any([c >> 15 for c in colors])
+    table = FIVE_BIT_TO_RGB
+    return [(table[c & 0x1f], table[(c >> 5) & 0x1f], table[(c >> 10) & 0x1f])
+            for c in colors]
+
+
+def rgb_to_colors(rgb_palette):
+    # A flat list of RGB values to 15-bit SNES colors.
+    channels = bytes(rgb_palette).translate(RGB_TO_5BIT)
+    return [r | (g << 5) | (b << 10)
+            for (r, g, b) in zip(channels[0::3],
+                                 channels[1::3],
+                                 channels[2::3])]
+
+
+class RomBuffer:
+    # A file-like wrapper around a memory-mapped ROM. Registered as the open
+    # file for the ROM, so table reads and writes, the patch writer and the
+    # sprite writer all share one buffer that is flushed once on close.
+    # Given data instead, the ROM is built in memory and written to output
+    # (a filename or a writable file object) once, on close.
+
+    def __init__(self, filename, size=EXHIROM_SIZE, data=None, output=None):
+        self.filename = filename
+        self.position = 0
+        if data is None:
+            self.file = open(filename, 'r+b')
+            self.file.seek(0, 2)
+            if self.file.tell() < size:
+                self.file.truncate(size)
+            self.data = mmap.mmap(self.file.fileno(), 0)
+            return
+
+        self.file = None
+        self.output = output if output is not None else filename
+        self.source_size = len(data)
+        self.data = bytearray(max(size, len(data)))
+        self.data[:len(data)] = data
+
+    @property
+    def closed(self):
+        if self.file is None:
+            return self.data is None
+        return self.data.closed
+
+    def seek(self, pointer, whence=0):
+        if whence == 1:
+            pointer += self.position
+        elif whence == 2:
+            pointer += len(self.data)
+        self.position = pointer
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.data) - self.position
+        data = self.data[self.position:self.position+size]
+        self.position += len(data)
+        return data
+
+    def view(self, pointer, size):
+        return memoryview(self.data)[pointer:pointer+size]
+
+    def write(self, data):
+        end = self.position + len(data)
+        if end > len(self.data):
+            if self.file is None:
+                self.data.extend(bytes(end - len(self.data)))
+            else:
+                self.data.resize(end)
+        self.data[self.position:end] = data
+        self.position = end
+        return len(data)
+
+    def move(self, destination, source, size):
+        if self.file is None:
+            self.data[destination:destination+size] = (
+                self.data[source:source+size])
+        else:
+            self.data.move(destination, source, size)
+
+    def flush(self):
+        if self.file is not None:
+            self.data.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        if self.file is None:
+            if isinstance(self.output, str):
+                with open(self.output, 'wb') as f:
+                    f.write(self.data)
+            else:
+                self.output.write(self.data)
+            self.data = None
+            return
+        self.data.flush()
+        self.data.close()
+        self.file.close()
+
+    def discard(self):
+        # Closes without writing the output. A memory-mapped ROM has been
+        # changing its file all along, so that is only closed.
+        if self.file is None:
+            self.data = None
+        else:
+            self.close()
+
+
+def open_rom_buffer(filename):
+    # randomtools keeps its open files in OPEN_FILES; putting the buffer
+    # there makes get_open_file hand it to every reader and writer.
+    if not hasattr(tablereader, 'OPEN_FILES'):
+        print('INFO: Memory-mapped ROM not supported by this randomtools.')
+        return None
+    close_file(filename)
+    rom = RomBuffer(filename)
+    tablereader.OPEN_FILES[filename] = rom
+    return rom
+
+
+def open_rom_source(source, output):
+    # Loads a read-only source ROM (a filename or bytes) into an in-memory
+    # RomBuffer that is written to output, a filename or a writable file
+    # object, when it is closed. The source itself is never written.
+    if not hasattr(tablereader, 'OPEN_FILES'):
+        raise Exception('In-memory ROMs not supported by this randomtools.')
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            source = f.read()
+    if isinstance(output, str):
+        filename = output
+    else:
+        filename = '<rom buffer {0:x}>'.format(id(output))
+    close_file(filename)
+    rom = RomBuffer(filename, data=source, output=output)
+    tablereader.OPEN_FILES[filename] = rom
+    return rom
+
+
+def identify_rom(data):
+    # The in-memory equivalent of determine_global_table, which can only
+    # hash a ROM that is already on disk. Modified ROMs, such as ones
+    # randomized by Beyond Chaos, are not recognized, and their version
+    # has to be given as rom_type instead.
+    checksum = md5(data).hexdigest()
+    for line in open(os.path.join(TABLES_DIRECTORY, 'master.txt')):
+        line = line.split()
+        if len(line) != 3:
+            continue
+        label, rom_checksum, tables_list = line
+        if rom_checksum == checksum:
+            return label, tables_list
+    raise Exception('Unknown ROM; rom_type must be given as "1.0" or '
+                    '"1.1".')
+
+
+def open_image(filename, data=None):
+    # Opens an image from its file, or from its data if already in memory.
+    if data is None:
+        return Image.open(filename)
+    image = Image.open(BytesIO(data))
+    image.filename = filename
+    return image
+
+
+def read_png_header(filename, data=None):
+    # Returns (width, height, palette size) from the PNG chunks that precede
+    # the pixel data, or None if the file is not a PNG. The palette size is
+    # None for images that are not paletted.
+    with (open(filename, 'rb') if data is None else BytesIO(data)) as f:
+        if f.read(len(PNG_SIGNATURE)) != PNG_SIGNATURE:
+            return None
+        size, num_colors = None, None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                break
+            length = int.from_bytes(chunk[:4], byteorder='big')
+            chunk_type = chunk[4:]
+            if chunk_type == b'IHDR':
+                data = f.read(length)
+                size = (int.from_bytes(data[0:4], byteorder='big'),
+                        int.from_bytes(data[4:8], byteorder='big'))
+                f.seek(4, 1)
+            elif chunk_type == b'PLTE':
+                num_colors = length // 3
+                break
+            elif chunk_type in (b'IDAT', b'IEND'):
+                break
+            else:
+                f.seek(length + 4, 1)
+    if size is None:
+        return None
+    width, height = size
+    return width, height, num_colors
+
+
+class ImageRecord:
+    # Everything needed to choose an image, read from the file header only.
+    # The pixel data is not decoded until the image is opened. With data,
+    # the image is read from memory and filename is only its name. Packs
+    # can hold tens of thousands of these, so they are kept small.
+    __slots__ = ['filename', 'tags', 'data', 'width', 'height',
+                 'num_colors', '_content_hash']
+
+    def __init__(self, filename, tags=None, data=None):
+        self.filename = filename
+        self.tags = set(tags) if tags else set([])
+        self.data = data
+        header = read_png_header(filename, data)
+        if header is None:
+            image = open_image(filename, data)
+            header = (image.width, image.height,
+                      len(image.getpalette()) // 3
+                      if image.mode == 'P' else None)
+            image.close()
+        self.width, self.height, self.num_colors = header
+
+    def __repr__(self):
+        return '{0} {1}x{2}'.format(self.filename, self.width, self.height)
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+    @property
+    def content_hash(self):
+        if not hasattr(self, '_content_hash'):
+            data = self.data
+            if data is None:
+                with open(self.filename, 'rb') as f:
+                    data = f.read()
+            self._content_hash = sha1(data).hexdigest()
+        return self._content_hash
+
+    def open(self):
+        image = open_image(self.filename, self.data)
+        image.tags = self.tags
+        return image
+
+
+def remap_palette(data, rgb_palette):
+    # Renumbers the colors in sorted order with a single translate pass.
+    zipped = zip(rgb_palette[0::3],
+                 rgb_palette[1::3],
+                 rgb_palette[2::3])
+    pal = enumerate(zipped)
+    pal = sorted(pal, key=lambda x: (x[1], x[0]))
+    old_vals = set(data)
+    assert all([0 <= v <= 0xf for v in old_vals])
+    table = bytearray(range(0x100))
+    new_palette = []
+    for new, (old, components) in enumerate(pal):
+        if new == 0:
+            assert new == old
+            assert components == (0, 0, 0)
+        table[old] = new
+        new_palette.append(components)
+    data = data.translate(table)
+    new_palette = [v for vs in new_palette for v in vs]
+    if DEBUG:
+        new_vals = set(data)
+        assert len(old_vals) == len(new_vals)
+        assert all([0 <= v <= 0xf for v in new_vals])
+    assert set(rgb_palette) == set(new_palette)
+    return data, new_palette
+
+
+class SpriteRecord:
+    # An image converted to sprite form: palette, 64 bytes of pixels per
+    # tile, and the stencil of which tiles are present. Everything except
+    # the PIL image is plain data, so records can be pickled.
+    CACHED_ATTRIBUTES = ['width', 'height', 'num_colors', 'transparency',
+                         'is_big', 'is_8color', 'palette', 'pixels',
+                         'stencil']
+
+    def __init__(self, filename, **kwargs):
+        self.filename = filename
+        self.image = kwargs.pop('image', None)
+        for attr in self.CACHED_ATTRIBUTES:
+            setattr(self, attr, kwargs[attr])
+
+    def __repr__(self):
+        return '{0} {1}x{2}'.format(self.filename, self.width, self.height)
+
+    @property
+    def is_wasteful(self):
+        return (self.num_colors <= 8 and not self.is_8color
+                and self.filename is not None)
+
+    def to_dict(self):
+        return {attr: getattr(self, attr) for attr in self.CACHED_ATTRIBUTES}
+
+
+def prepare_sprite(image, transparency=None, preserve_palette_order=False):
+    # Converts an image into a SpriteRecord, or returns None if it has
+    # too many colors to be a sprite.
+    if image.mode != 'P':
+        filename = image.filename
+        image = image.convert(mode='P')
+        image.filename = filename
+
+    width, height = image.size
+    if width > 128 or height > 128:
+        raise Exception('Image larger than 128x128 not allowed.')
+    is_big = width > 64 or height > 64
+
+    data = image.tobytes()
+    palette_indexes = set(data)
+    if max(palette_indexes) > 0xf:
+        print('INFO: %s has too many colors.' % image.filename)
+        return None
+
+    is_8color = max(palette_indexes) <= 7
+
+    if transparency is None:
+        border = (data[0::width] + data[width-1::width] +
+                  data[:width] + data[(height-1)*width:])
+        transparency = Counter(border).most_common(1)[0][0]
+
+    palette = image.getpalette()
+    if transparency != 0:
+        table = bytearray(range(0x100))
+        table[0], table[transparency] = transparency, 0
+        data = data.translate(table)
+        image.frombytes(data)
+        index = 3 * transparency
+        temp = palette[index:index+3]
+        assert len(temp) == 3
+        palette[index:index+3] = palette[0:3]
+        palette[0:3] = temp
+    palette[0:3] = [0, 0, 0]
+    num_colors = 8 if is_8color else 16
+    image.putpalette(palette)
+    palette = palette[:3*num_colors]
+
+    if hasattr(image, 'filename'):
+        # Trim fully transparent bands of 8 rows from the top.
+        first_pixel = len(data) - len(data.lstrip(b'\x00'))
+        if first_pixel == len(data):
+            raise Exception('Fully transparent image not allowed.')
+        trim = (first_pixel // width) // 8 * 8
+        if trim:
+            new_image = image.crop((0, trim, width, height))
+            new_image.filename = image.filename
+            image = new_image
+            data = data[trim*width:]
+            height -= trim
+            assert image.height == height
+
+    remapped = remap_palette(data, palette)
+    if not preserve_palette_order:
+        data, palette = remapped
+
+    # Copy the image onto a blank canvas of the full sprite size, so that
+    # every tile can be sliced out of it directly.
+    if is_big:
+        num_tiles_width = 16
+    else:
+        num_tiles_width = 8
+    canvas_width = num_tiles_width * 8
+    canvas = bytearray(canvas_width * canvas_width)
+    row_width = min(width, canvas_width)
+    for y in range(min(height, canvas_width)):
+        canvas[y*canvas_width:(y*canvas_width)+row_width] = (
+            data[y*width:(y*width)+row_width])
+    canvas = bytes(canvas)
+
+    blank_tile = bytes(64)
+    blank_band = bytes(canvas_width * 8)
+    new_tiles = []
+    stencil = []
+    for jj in range(num_tiles_width):
+        stencil_value = 0
+        band = canvas[jj*len(blank_band):(jj+1)*len(blank_band)]
+        if band != blank_band:
+            rows = [band[j*canvas_width:(j+1)*canvas_width]
+                    for j in range(8)]
+            for ii in range(num_tiles_width):
+                tile = b''.join([row[ii*8:(ii+1)*8] for row in rows])
+                if tile != blank_tile:
+                    new_tiles.append(tile)
+                    stencil_value |= (1 << (num_tiles_width-(ii+1)))
+        if is_big:
+            stencil_value = ((stencil_value >> 8) |
+                             ((stencil_value & 0xff) << 8))
+        stencil.append(stencil_value)
+
+    return SpriteRecord(
+        getattr(image, 'filename', None), image=image,
+        width=image.width, height=image.height,
+        num_colors=len(palette_indexes), transparency=transparency,
+        is_big=is_big, is_8color=is_8color, palette=palette,
+        pixels=b''.join(new_tiles), stencil=stencil)
+
+
+def preprocess_image(filename, data=None):
+    # Runs in a worker process. Messages are discarded here and printed
+    # again by load_image if the image is actually chosen.
+    try:
+        with redirect_stdout(StringIO()), \
+                open_image(filename, data) as image:
+            record = prepare_sprite(image)
+    except Exception as e:
+        return e
+    if record is None:
+        return Exception('Too many colors.')
+    record.image = None
+    return record
+
+
+def preprocess_job(job):
+    return preprocess_image(*job)
+
+
+def get_rejection(record):
+    # Why no sprite could be made of an image.
+    return str(record) or type(record).__name__
+
+
+def validate_images(images):
+    # The rejections that can be made from the image headers alone, so
+    # nothing is decoded. Color counts and transparency are only known
+    # once an image is decoded: by preprocess_images, or by load_image
+    # the first time the image is chosen.
+    return {image.filename: Exception('Image larger than 128x128 not allowed.')
+            for image in images if image.width > 128 or image.height > 128}
+
+
+def preprocess_images(images, processes=None, cache=None, streaming=False):
+    # Converts every image into a SpriteRecord up front, in a pool of
+    # worker processes. The result maps filenames to a SpriteRecord, or to
+    # the exception the image raised if it cannot be a sprite.
+    # With streaming, SpriteRecords are not kept: they go into the cache,
+    # if there is one, as they arrive, and only failures are returned, so
+    # memory does not grow with the size of the pack.
+    records = {}
+    todo = {}
+    for image in images:
+        record = None
+        if cache is not None:
+            record = cache.get(image)
+        if record is None:
+            todo[image.filename] = image
+        elif not (streaming and isinstance(record, SpriteRecord)):
+            records[image.filename] = record
+
+    filenames = sorted(todo)
+    if filenames:
+        processes = processes or os.cpu_count() or 1
+        chunksize = max(1, len(filenames) // (processes * 4))
+        jobs = [(f, todo[f].data) for f in filenames]
+        with Pool(processes) as pool:
+            results = pool.imap(preprocess_job, jobs, chunksize=chunksize)
+            for filename, record in zip(filenames, results):
+                if cache is not None:
+                    cache.put(todo[filename], record)
+                if streaming and isinstance(record, SpriteRecord):
+                    continue
+                records[filename] = record
+
+    return records
+
+
+def get_sprite_records(images, processes=None, cache=None, streaming=False,
+                       validate=True):
+    # What is known about the images before any run: with validate, the
+    # images rejected from their headers, and with processes, the rest as
+    # converted by preprocess_images.
+    records = validate_images(images) if validate else {}
+    if processes is not None:
+        records.update(preprocess_images(
+            [image for image in images if image.filename not in records],
+            processes=processes, cache=cache, streaming=streaming))
+    return records
+
+
+class SpriteCache:
+    # A directory of SpriteRecords keyed by a hash of the image file's
+    # contents, so unchanged images never need to be decoded again. Images
+    # that cannot be sprites are kept as the reason why, and come back as
+    # an exception. The least recently used entries are deleted once
+    # max_size is exceeded.
+    CACHE_VERSION = '1'
+
+    def __init__(self, directory, max_size=0x10000000):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+        self.entries = {}
+        for name in os.listdir(directory):
+            if name.endswith('.tmp'):
+                continue
+            stat = os.stat(os.path.join(directory, name))
+            self.entries[name] = (stat.st_mtime, stat.st_size)
+
+    @property
+    def total_size(self):
+        return sum([size for (_, size) in self.entries.values()])
+
+    def get_key(self, image):
+        return '{0}-{1}'.format(self.CACHE_VERSION, image.content_hash)
+
+    def get(self, image):
+        key = self.get_key(image)
+        if key not in self.entries:
+            return None
+        filepath = os.path.join(self.directory, key)
+        try:
+            with open(filepath, 'rb') as f:
+                data = pickle.load(f)
+            os.utime(filepath)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            del(self.entries[key])
+            return None
+        self.entries[key] = (time(), self.entries[key][1])
+        if 'rejection' in data:
+            return Exception(data['rejection'])
+        return SpriteRecord(image.filename, **data)
+
+    def put(self, image, record):
+        key = self.get_key(image)
+        filepath = os.path.join(self.directory, key)
+        temp_filepath = '{0}.{1}.tmp'.format(filepath, os.getpid())
+        if isinstance(record, Exception):
+            data = {'rejection': get_rejection(record)}
+        else:
+            data = record.to_dict()
+        with open(temp_filepath, 'wb') as f:
+            pickle.dump(data, f)
+        os.replace(temp_filepath, filepath)
+        self.entries[key] = (time(), os.path.getsize(filepath))
+        self.evict()
+
+    def evict(self):
+        total_size = self.total_size
+        if total_size <= self.max_size:
+            return
+        for key in sorted(self.entries, key=lambda k: self.entries[k]):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.directory, key))
+            except OSError:
+                pass
+            total_size -= self.entries[key][1]
+            del(self.entries[key])
+
+
+class SizeCompatibilityMatrix:
+    # Size scores of every monster against every image. Scores depend only
+    # on the monster's sprite dimensions and the image's size in tiles, so
+    # each row is built once per distinct monster shape from a table of
+    # distinct image sizes. Images too big for the monster score None.
+
+    def __init__(self, monsters, images):
+        self.images = list(images)
+        self.image_ids = {image.filename: i
+                          for (i, image) in enumerate(self.images)}
+        self.image_sizes = [(ceil(image.width / 8), ceil(image.height / 8))
+                            for image in self.images]
+        self.sizes = sorted(set(self.image_sizes))
+        self.size_scores = {}
+        self.rows = {}
+        for mso in monsters:
+            self.get_row(mso)
+
+    def __contains__(self, image):
+        return getattr(image, 'filename', None) in self.image_ids
+
+    @staticmethod
+    def get_shape(mso):
+        return (mso.width_tiles, mso.height_tiles,
+                mso.max_width_tiles, mso.max_height_tiles)
+
+    def get_row(self, mso):
+        shape = self.get_shape(mso)
+        if shape in self.rows:
+            return self.rows[shape]
+
+        width_tiles, height_tiles, max_width_tiles, max_height_tiles = shape
+        scores = {}
+        for (width, height) in self.sizes:
+            if width > max_width_tiles or height > max_height_tiles:
+                scores[width, height] = None
+                continue
+            a, b = max(width, width_tiles), min(width, width_tiles)
+            width_score = b / a
+            a, b = max(height, height_tiles), min(height, height_tiles)
+            height_score = b / a
+            scores[width, height] = width_score * height_score
+
+        self.size_scores[shape] = scores
+        self.rows[shape] = [scores[size] for size in self.image_sizes]
+        return self.rows[shape]
+
+    def get_scores(self, mso, images):
+        row = self.get_row(mso)
+        return [row[self.image_ids[image.filename]] for image in images]
+
+
+class ImageIndex:
+    # Bitmaps over an images list, one bit per image, for each tag, each
+    # image size, big images, and images already used. Candidate filtering
+    # for a monster is then a handful of integer AND/OR operations.
+
+    def __init__(self, images, monsters=()):
+        self.images = images if isinstance(images, list) else list(images)
+        self.image_ids = {image.filename: i
+                          for (i, image) in enumerate(self.images)}
+        self.matrix = SizeCompatibilityMatrix(monsters, self.images)
+        self.all_mask = (1 << len(self.images)) - 1
+        self.big_mask = 0
+        self.filename_masks = {}
+        self.tag_masks = {}
+        self.size_masks = {}
+        for (i, image) in enumerate(self.images):
+            bit = 1 << i
+            self.filename_masks[image.filename] = (
+                self.filename_masks.get(image.filename, 0) | bit)
+            if image.width > 64 or image.height > 64:
+                self.big_mask |= bit
+            for tag in getattr(image, 'tags', []):
+                self.tag_masks[tag] = self.tag_masks.get(tag, 0) | bit
+            size = self.matrix.image_sizes[i]
+            self.size_masks[size] = self.size_masks.get(size, 0) | bit
+        self.fit_masks = {}
+        self.done_images = None
+        self.done_mask = 0
+        self.num_done = 0
+
+    def __contains__(self, image):
+        return getattr(image, 'filename', None) in self.image_ids
+
+    def get_mask(self, images):
+        mask = 0
+        for image in images:
+            mask |= self.filename_masks[image.filename]
+        return mask
+
+    def get_images(self, mask):
+        bits = bin(mask)[:1:-1]
+        return [self.images[i] for (i, bit) in enumerate(bits) if bit == '1']
+
+    def get_fit_mask(self, mso):
+        shape = self.matrix.get_shape(mso)
+        if shape not in self.fit_masks:
+            self.matrix.get_row(mso)
+            mask = 0
+            for size, score in self.matrix.size_scores[shape].items():
+                if score is not None:
+                    mask |= self.size_masks[size]
+            self.fit_masks[shape] = mask
+        return self.fit_masks[shape]
+
+    def get_done_mask(self, done_images):
+        # done_images only ever grows, so only new entries are looked up.
+        # A different list means a different run, so start over.
+        if done_images is not self.done_images:
+            self.done_images = done_images
+            self.done_mask = 0
+            self.num_done = 0
+        for filename in done_images[self.num_done:]:
+            self.done_mask |= self.filename_masks.get(filename, 0)
+        self.num_done = len(done_images)
+        return self.done_mask
+
+    def get_whitelist_mask(self, tags):
+        mask = self.all_mask
+        for tag in tags:
+            mask &= self.tag_masks.get(tag, 0)
+        return mask
+
+    def get_blacklist_mask(self, tags):
+        mask = 0
+        for tag in tags:
+            mask |= self.tag_masks.get(tag, 0)
+        return mask
+
+
+class GraphicsLayout:
+    # Builds the contents of the new monster graphics region before any of
+    # it is written. Sprite pointers count 16-byte units, so a sprite can
+    # start at any aligned offset: identical graphics share one copy, a
+    # sprite found anywhere inside already placed data points there, and a
+    # sprite whose head matches the current tail overlaps it.
+    ALIGNMENT = 16
+
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+        self.data = bytearray()
+        self.offsets = {}
+        self.added = {}
+        self.padding = 0
+
+    @property
+    def capacity(self):
+        return self.end - self.start
+
+    @property
+    def used(self):
+        return len(self.data)
+
+    @property
+    def remaining(self):
+        return self.capacity - self.used
+
+    def report(self):
+        return ('Monster graphics: {0:x} bytes used, {1:x} bytes remaining, '
+                '{2:x} bytes of padding.'.format(
+                    self.used, self.remaining, self.padding))
+
+    def find(self, graphics):
+        index = self.data.find(graphics)
+        while index >= 0 and index % self.ALIGNMENT:
+            index = self.data.find(graphics, index+1)
+        return index
+
+    def get_overlap(self, graphics, limit=None):
+        # The longest head of graphics that matches the tail of the data
+        # and starts at an aligned offset.
+        length = len(self.data) % self.ALIGNMENT
+        longest = 0
+        if limit is None:
+            limit = len(graphics)
+        limit = min(limit, len(graphics), len(self.data))
+        while length <= limit:
+            if length and self.data.endswith(graphics[:length]):
+                longest = length
+            length += self.ALIGNMENT
+        return longest
+
+    def place(self, graphics):
+        graphics = bytes(graphics)
+        if graphics in self.offsets:
+            return self.offsets[graphics]
+
+        offset = self.find(graphics)
+        if offset < 0:
+            overlap = self.get_overlap(graphics)
+            if not overlap:
+                remainder = len(self.data) % self.ALIGNMENT
+                if remainder:
+                    self.padding += self.ALIGNMENT - remainder
+                    self.data += bytes(self.ALIGNMENT - remainder)
+            offset = len(self.data) - overlap
+            self.data += graphics[overlap:]
+            self.added[graphics] = len(graphics) - overlap
+
+        assert not offset % self.ALIGNMENT
+        self.offsets[graphics] = offset
+        return offset
+
+    def pack(self, blocks):
+        # Places the largest blocks first, so smaller ones have the best
+        # chance of being found inside them. Whenever the data ends
+        # unaligned, the next block is one that can overlap the tail
+        # instead of being padded, if there is one.
+        remaining = sorted(set(blocks), key=lambda b: (-len(b), b))
+        while remaining:
+            chosen = remaining[0]
+            unaligned = len(self.data) % self.ALIGNMENT
+            if unaligned and self.find(chosen) < 0:
+                for graphics in remaining:
+                    if self.get_overlap(graphics, limit=unaligned):
+                        chosen = graphics
+                        break
+            self.place(chosen)
+            remaining.remove(chosen)
+
+    def get_pointer(self, graphics):
+        offset = self.place(graphics)
+        pointer = offset // self.ALIGNMENT
+        assert 0 <= pointer <= 0x7fff
+        return pointer
+
+    def claim(self, graphics):
+        # How many bytes these graphics added to the region, counted for
+        # the first sprite to claim them only.
+        return self.added.pop(bytes(graphics), 0)
+
+    def get_writes(self):
+        return [(0, self.data)]
+
+
+class RerollLayout(GraphicsLayout):
+    # The graphics region of a ROM that was already remonstered. Graphics
+    # still in use stay where they are; new graphics are found inside them
+    # or go into the first gap left between them, and only new graphics
+    # are written back. remaining is the space in those gaps, so space
+    # freed by the reroll counts, and padding is what is left between
+    # graphics that no gap can start in.
+
+    def __init__(self, start, end, data, extents):
+        self.start = start
+        self.end = end
+        self.offsets = {}
+        self.added = {}
+        self.extents = []
+        for (a, b) in extents:
+            self.add_extent(a, b)
+        self.data = bytearray(data[:self.extents[-1][1]]
+                              if self.extents else b'')
+        self.writes = []
+
+    @property
+    def used(self):
+        return self.capacity - self.remaining
+
+    @property
+    def remaining(self):
+        return sum([b - a for (a, b) in self.gaps])
+
+    @property
+    def padding(self):
+        return self.used - sum([b - a for (a, b) in self.extents])
+
+    @property
+    def gaps(self):
+        gaps = []
+        position = 0
+        for (a, b) in self.extents + [(self.capacity, self.capacity)]:
+            if position % self.ALIGNMENT:
+                position += self.ALIGNMENT - (position % self.ALIGNMENT)
+            if a > position:
+                gaps.append((position, a))
+            position = max(position, b)
+        return gaps
+
+    def add_extent(self, start, end):
+        extents = sorted(self.extents + [(start, end)])
+        self.extents = extents[:1]
+        for (a, b) in extents[1:]:
+            c, d = self.extents[-1]
+            if a <= d:
+                self.extents[-1] = (c, max(b, d))
+            else:
+                self.extents.append((a, b))
+
+    def is_used(self, offset, length):
+        for (a, b) in self.extents:
+            if a <= offset and offset + length <= b:
+                return True
+        return False
+
+    def find(self, graphics):
+        index = self.data.find(graphics)
+        while index >= 0 and (index % self.ALIGNMENT
+                              or not self.is_used(index, len(graphics))):
+            index = self.data.find(graphics, index+1)
+        return index
+
+    def place(self, graphics):
+        graphics = bytes(graphics)
+        if graphics in self.offsets:
+            return self.offsets[graphics]
+
+        offset = self.find(graphics)
+        if offset < 0:
+            for (a, b) in self.gaps:
+                if b - a >= len(graphics):
+                    offset = a
+                    break
+            else:
+                raise Exception('Not enough space for monster graphics: '
+                                '%x bytes needed.' % len(graphics))
+            end = offset + len(graphics)
+            if end > len(self.data):
+                self.data += bytes(end - len(self.data))
+            self.data[offset:end] = graphics
+            self.added[graphics] = len(graphics)
+            self.writes.append((offset, end))
+            self.add_extent(offset, end)
+
+        self.offsets[graphics] = offset
+        return offset
+
+    def get_writes(self):
+        return [(a, self.data[a:b]) for (a, b) in self.writes]
+
+
+class StencilTables:
+    # The comp8 and comp16 stencil tables of a ROM that was already
+    # remonstered. Both are in the bank of new_comp8_pointer, found
+    # through the pointers there, with the comp16 table directly after
+    # the comp8 one. Freed entries are reused, and the comp8 table grows by
+    # moving the comp16 table up.
+
+    def __init__(self, filename):
+        self.filename = filename
+        f = get_open_file(filename)
+        bank = addresses.new_comp8_pointer & 0xff0000
+        f.seek(addresses.new_comp8_pointer)
+        self.comp8_base = bank | int.from_bytes(f.read(2), byteorder='little')
+        f.seek(addresses.new_comp16_pointer)
+        self.comp16_base = bank | int.from_bytes(f.read(2),
+                                                 byteorder='little')
+        self.num_comp8 = (self.comp16_base - self.comp8_base) // 8
+        self.num_comp16 = 0
+        self.free8 = []
+        self.free16 = []
+
+    def set_used(self, used8, used16, num_comp16):
+        self.num_comp16 = num_comp16
+        self.free8 = sorted(set(range(self.num_comp8)) - set(used8))
+        self.free16 = sorted(set(range(self.num_comp16)) - set(used16))
+
+    def read(self, index, is_big):
+        f = get_open_file(self.filename)
+        if is_big:
+            f.seek(self.comp16_base + (index * 32))
+            data = f.read(32)
+            return [int.from_bytes(data[i:i+2], byteorder='little')
+                    for i in range(0, 32, 2)]
+        f.seek(self.comp8_base + (index * 8))
+        return list(f.read(8))
+
+    def grow_comp8(self):
+        size = self.num_comp16 * 32
+        assert self.comp16_base + size + 8 <= addresses.new_palette_pointer
+        f = get_open_file(self.filename)
+        f.seek(self.comp16_base)
+        data = f.read(size)
+        self.comp16_base += 8
+        f.seek(self.comp16_base)
+        f.write(data)
+        f.seek(addresses.new_comp16_pointer)
+        f.write((self.comp16_base & 0xffff).to_bytes(2, byteorder='little'))
+        self.free8.append(self.num_comp8)
+        self.num_comp8 += 1
+
+    def add(self, stencil, is_big):
+        if is_big:
+            if self.free16:
+                index = self.free16.pop(0)
+            else:
+                index = self.num_comp16
+                self.num_comp16 += 1
+            pointer = self.comp16_base + (index * 32)
+            data = b''.join([v.to_bytes(2, byteorder='little')
+                             for v in stencil])
+        else:
+            if not self.free8:
+                self.grow_comp8()
+            index = self.free8.pop(0)
+            pointer = self.comp8_base + (index * 8)
+            data = bytes(stencil)
+        assert index <= 0xff
+        assert pointer + len(data) <= addresses.new_palette_pointer
+        f = get_open_file(self.filename)
+        f.seek(pointer)
+        f.write(data)
+        return index
+
+
+class PaletteAllocator:
+    # The monster palettes in use. Each palette index holds 8 colors, and a
+    # 16-color sprite takes two indexes in a row. used is every index taken,
+    # and palettes maps the 15-bit colors at each index, and at each pair of
+    # indexes holding a 16-color palette, to that index, so an identical
+    # palette is shared instead of being written again.
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.used = set([])
+        self.palettes = {}
+        self.last_index = -1
+        self.shared = 0
+
+    @property
+    def remaining(self):
+        return self.capacity - len(self.used)
+
+    def report(self):
+        return ('Monster palettes: {0} used, {1} remaining, '
+                '{2} shared.'.format(len(self.used), self.remaining,
+                                     self.shared))
+
+    def is_free(self, index, is_8color=True):
+        if index in self.used:
+            return False
+        if is_8color:
+            return True
+        return index + 1 < self.capacity and index + 1 not in self.used
+
+    def get_free(self, is_8color=True):
+        # Palettes are handed out in order, starting after the last one.
+        index = self.last_index
+        while True:
+            index += 1
+            if index >= self.capacity:
+                raise Exception('Not enough space for monster palettes.')
+            if self.is_free(index, is_8color):
+                self.last_index = index
+                self.used.add(index)
+                return index
+
+    def find(self, colors):
+        index = self.palettes.get(tuple(colors))
+        if index is not None:
+            self.shared += 1
+        return index
+
+    def add(self, index, colors):
+        # colors are the 8 colors at index, or 16 running on into the next.
+        for i in range(0, len(colors), 8):
+            self.used.add(index + (i // 8))
+            self.palettes.setdefault(tuple(colors[i:i+8]), index + (i // 8))
+        self.palettes.setdefault(tuple(colors), index)
+
+
 class MouldObject(TableObject):
     # Moulds are templates for what enemy sizes are allowed
     # in an enemy formation. Enemies are generally 4, 8, 12, or 16
@@ -64,11 +1221,10 @@ class FormationObject(TableObject): pass
 class MonsterSpriteObject(TableObject):
     SUPER_PROTECTED_INDEXES = [0x106]
     PROTECTED_INDEXES = list(range(0x180, 0x1a0))
-    DONE_IMAGES = []
 
     def __repr__(self):
-        if hasattr(self, 'image') and hasattr(self.image, 'filename'):
-            return '{0:0>3X} {1}'.format(self.index, self.image.filename)
+        if getattr(self, 'image_filename', None) is not None:
+            return '{0:0>3X} {1}'.format(self.index, self.image_filename)
         else:
             return '{0:0>3X} ---'.format(self.index)
 
@@ -78,6 +1234,10 @@ class MonsterSpriteObject(TableObject):
 
     @property
     def sprite_pointer(self):
+        if get_session().remonstered:
+            return ((self.misc_sprite_pointer & 0x7FFF)
+                    * GraphicsLayout.ALIGNMENT
+                    + addresses.new_monster_graphics)
         base_address = addresses.monster_graphics
         return (self.misc_sprite_pointer & 0x7FFF) * 8 + base_address
 
@@ -105,6 +1265,11 @@ class MonsterSpriteObject(TableObject):
     def stencil(self):
         if hasattr(self, '_stencil'):
             return self._stencil
+        stencil_tables = get_session().stencil_tables
+        if stencil_tables is not None:
+            self._stencil = stencil_tables.read(self.stencil_index,
+                                                self.is_big)
+            return self.stencil
         mcomp = MonsterComp16Object if self.is_big else MonsterComp8Object
         self._stencil =  list(mcomp.get(self.stencil_index).stencil)
         return self.stencil
@@ -128,6 +1293,10 @@ class MonsterSpriteObject(TableObject):
 
     @cached_property
     def pair_protected(self):
+        if get_session().remonstered:
+            # The pointers no longer say which sprites were paired; those
+            # are in the session's protected indexes instead.
+            return None
         for index in self.SUPER_PROTECTED_INDEXES:
             if index == self.index:
                 continue
@@ -144,6 +1313,9 @@ class MonsterSpriteObject(TableObject):
 
     @property
     def is_protected(self):
+        session = get_session()
+        if session.remonstered:
+            return self.index in session.protected_indexes
         if self.index in self.PROTECTED_INDEXES + self.SUPER_PROTECTED_INDEXES:
             return True
         if self.is_unseen:
@@ -151,72 +1323,27 @@ class MonsterSpriteObject(TableObject):
         return False
 
     def deinterleave_tile(self, tile):
-        rows = []
-        old_bitcount = sum([bin(v).count('1') for v in tile])
-        for i in range(8):
-            if self.is_8color:
-                interleaved = (tile[i*2], tile[(i*2)+1],
-                               tile[i+16])
-            else:
-                interleaved = (tile[i*2], tile[(i*2)+1],
-                               tile[(i*2)+16], tile[(i*2)+17])
-            row = []
-            for j in range(7, -1, -1):
-                pixel = 0
-                mask = 1 << j
-                for k, v in enumerate(interleaved):
-                    pixel |= bool(v & mask) << k
-
-                if self.is_8color:
-                    assert 0 <= pixel <= 7
-                else:
-                    assert 0 <= pixel <= 0xf
-                row.append(pixel)
-
-            assert len(row) == 8
-            rows.append(row)
-
-        assert len(rows) == 8
-        #assert self.interleave_tile(rows) == tile
-        new_bitcount = sum([bin(v).count('1') for vs in rows for v in vs])
-        assert old_bitcount == new_bitcount
-        return rows
+        return pixels_to_tiles(deinterleave_tiles(tile, self.is_8color))[0]
 
     def interleave_tile(self, old_tile):
-        if self.is_8color:
-            new_tile = [0]*24
-        else:
-            new_tile = [0]*32
-
-        old_bitcount = sum([bin(v).count('1') for vs in old_tile for v in vs])
         assert len(old_tile) == 8
-        for (j, old_row) in enumerate(old_tile):
-            assert len(old_row) == 8
-            for (i, pixel) in enumerate(old_row):
-                i = 7 - i
-                a = bool(pixel & 1)
-                b = bool(pixel & 2)
-                c = bool(pixel & 4)
-                d = bool(pixel & 8)
-
-                new_tile[(j*2)] |= (a << i)
-                new_tile[(j*2)+1] |= (b << i)
-                if self.is_8color:
-                    new_tile[j+16] |= (c << i)
-                else:
-                    new_tile[(j*2)+16] |= (c << i)
-                    new_tile[(j*2)+17] |= (d << i)
-
-        new_bitcount = sum([bin(v).count('1') for v in new_tile])
-
-        assert old_bitcount == new_bitcount
-        assert self.deinterleave_tile(new_tile) == old_tile
-        return bytes(new_tile)
+        return interleave_tiles(tiles_to_pixels([old_tile]), self.is_8color)
 
     @property
     def tiles(self):
-        if hasattr(self, '_tiles'):
-            return self._tiles
+        if not hasattr(self, '_tiles'):
+            self._tiles = pixels_to_tiles(self.tile_pixels)
+        return self._tiles
+
+    @property
+    def tile_pixels(self):
+        if hasattr(self, '_tile_pixels'):
+            return self._tile_pixels
+
+        if hasattr(self, '_graphics_data'):
+            self._tile_pixels = deinterleave_tiles(self._graphics_data,
+                                                   self.is_8color)
+            return self.tile_pixels
 
         if self.is_8color:
             numbytes = 24
@@ -224,52 +1351,55 @@ class MonsterSpriteObject(TableObject):
             numbytes = 32
 
         f = get_open_file(self.filename)
-        tiles = []
-        for i in range(self.num_tiles):
-            f.seek(self.sprite_pointer + (numbytes*i))
-            tiles.append(self.deinterleave_tile(f.read(numbytes)))
+        size = self.num_tiles * numbytes
+        if isinstance(f, RomBuffer):
+            with f.view(self.sprite_pointer, size) as data:
+                pixels = deinterleave_tiles(data, self.is_8color)
+        else:
+            f.seek(self.sprite_pointer)
+            pixels = deinterleave_tiles(f.read(size), self.is_8color)
 
-        self._tiles = tiles
-        return self.tiles
+        self._tile_pixels = pixels
+        return self.tile_pixels
 
-    @property
-    def all_pixels(self):
-        tiles = list(self.tiles)
+    def render_pixels(self):
+        # Scatters the tiles into a blank canvas, following the stencil.
         if self.is_big:
             width = 16
         else:
             width = 8
+        canvas_width = width * 8
+        canvas = bytearray(canvas_width * canvas_width)
+        pixels = self.tile_pixels
 
-        blank_tile = [[0]*8]*8
-
-        height = width
-        rows = []
-        for y in range(height):
-            row = []
+        offset = 0
+        for y in range(width):
+            stencil_value = self.stencil[y]
+            if self.is_big:
+                stencil_value = ((stencil_value >> 8) |
+                                 ((stencil_value & 0xff) << 8))
+            if not stencil_value:
+                continue
             for x in range(width):
-                stencil_value = self.stencil[y]
-                if self.is_big:
-                    stencil_value = ((stencil_value >> 8) |
-                                     ((stencil_value & 0xff) << 8))
-                to_tile = stencil_value & (1 << (width-(x+1)))
-                if to_tile:
-                    row.append(tiles.pop(0))
-                else:
-                    row.append(blank_tile)
-            rows.append(row)
+                if not stencil_value & (1 << (width-(x+1))):
+                    continue
+                if offset >= len(pixels):
+                    raise IndexError('Stencil has more tiles than sprite.')
+                base = (y * 8 * canvas_width) + (x * 8)
+                for j in range(8):
+                    start = base + (j * canvas_width)
+                    canvas[start:start+8] = pixels[offset:offset+8]
+                    offset += 8
 
-        all_pixels = []
-        for row in rows:
-            for i in range(8):
-                for tile in row:
-                    tile_row = tile[i]
-                    all_pixels.extend(tile_row)
+        return bytes(canvas)
 
-        return all_pixels
+    @property
+    def all_pixels(self):
+        return list(self.render_pixels())
 
     @property
     def palette_indexes(self):
-        return set(self.all_pixels)
+        return set(self.render_pixels())
 
     @property
     def image(self):
@@ -281,9 +1411,11 @@ class MonsterSpriteObject(TableObject):
         else:
             width = 8*8
         height = width
-        data = bytes(self.all_pixels)
+        data = self.render_pixels()
         im = Image.frombytes(mode='P', size=(width, height), data=data)
         im.putpalette(self.palette)
+        if getattr(self, 'image_filename', None) is not None:
+            im.filename = self.image_filename
 
         self._image = im
         return self.image
@@ -326,15 +1458,20 @@ class MonsterSpriteObject(TableObject):
         if not hasattr(self, '_image_scores'):
             self._image_scores = {}
 
+        if isinstance(image, str):
+            image = ImageRecord(image)
+
+        index = get_session().image_index
+        if index is not None and image in index:
+            return index.matrix.get_scores(self, [image])[0]
+
         if image.filename in self._image_scores:
             return self._image_scores[image.filename]
 
-        if isinstance(image, str):
-            image = Image.open(image)
-
         width = ceil(image.width / 8)
         height = ceil(image.height / 8)
-        image.close()
+        if not isinstance(image, ImageRecord):
+            image.close()
 
         if width > self.max_width_tiles or height > self.max_height_tiles:
             return None
@@ -350,207 +1487,189 @@ class MonsterSpriteObject(TableObject):
         return self.get_size_compatibility(image)
 
     def select_image(self, images=None):
+        session = get_session()
         if self.is_protected:
-            self.load_image(self.image)
+            with session.timed('image_load'):
+                self.load_image(self.image)
             return
 
         if images is None:
-            images = MonsterSpriteObject.import_images
+            images = session.images
+
+        image_index = session.image_index
+        if (image_index is None
+                or not all([i in image_index for i in images])):
+            image_index = ImageIndex(images, [self])
+            session.image_index = image_index
+        if images is image_index.images:
+            mask = image_index.all_mask
+        else:
+            mask = image_index.get_mask(images)
 
-        candidates = [i for i in images if
-                      i.filename not in self.DONE_IMAGES and
-                      self.get_size_compatibility(i) is not None
-                      ]
+        mask &= image_index.get_fit_mask(self)
+        mask &= ~image_index.get_done_mask(session.done_images)
 
         if self.is_actually_big and random.random() > 0.1:
-            temp = [c for c in candidates if c.width > 64 or c.height > 64]
-            candidates = temp or candidates
+            temp = mask & image_index.big_mask
+            mask = temp or mask
 
         if hasattr(self, 'whitelist') and self.whitelist:
-            candidates = [c for c in candidates
-                          if hasattr(c, 'tags') and c.tags >= self.whitelist]
+            mask &= image_index.get_whitelist_mask(self.whitelist)
 
         if hasattr(self, 'blacklist') and self.blacklist:
-            candidates = [c for c in candidates if not
-                          (hasattr(c, 'tags') and c.tags & self.blacklist)]
+            mask &= ~image_index.get_blacklist_mask(self.blacklist)
 
-        if not candidates:
-            self.load_image(self.image)
-            print('INFO: No more suitable images for sprite %x' % self.index)
-            return False
+        candidates = image_index.get_images(mask)
+        row = image_index.matrix.get_row(self)
 
         def sort_func(c):
-            return self.get_size_compatibility(c), sig_func(c)
+            return row[image_index.image_ids[c.filename]], sig_func(c)
 
+        # An image that fails to load is used up and the next one is drawn
+        # from the rest, which are already sorted.
         candidates = sorted(candidates, key=sort_func)
-        max_index = len(candidates)-1
-        index = random.randint(
-            random.randint(random.randint(0, max_index), max_index), max_index)
-        chosen = candidates[index]
-
-        self.DONE_IMAGES.append(chosen.filename)
-        result = self.load_image(chosen)
-        if not result:
-            self.select_image(candidates)
-        return True
+        while candidates:
+            max_index = len(candidates)-1
+            index = random.randint(
+                random.randint(random.randint(0, max_index), max_index),
+                max_index)
+            chosen = candidates.pop(index)
+
+            session.done_images.append(chosen.filename)
+            with session.timed('image_load'):
+                result = self.load_image(chosen)
+            if result:
+                return True
+
+        with session.timed('image_load'):
+            if session.remonstered:
+                # A rerolled monster keeps its sprite exactly as it is.
+                self.encode()
+            else:
+                self.load_image(self.image)
+        print('INFO: No more suitable images for sprite %x' % self.index)
+        return False
+
+    def encode(self):
+        # Puts the sprite in the form it is written in: SNES graphics,
+        # palette and stencil. The decoded tiles and image are dropped, so
+        # until the ROM is written each monster holds only its graphics.
+        if not hasattr(self, '_graphics_data'):
+            self._graphics_data = interleave_tiles(self.tile_pixels,
+                                                   self.is_8color)
+        self.palette
+        self.stencil
+        for attr in ['_image', '_tiles', '_tile_pixels']:
+            if hasattr(self, attr):
+                delattr(self, attr)
+        return self._graphics_data
+
+    @property
+    def graphics_data(self):
+        return self.encode()
+
+    @classmethod
+    def get_graphics_layout(cls):
+        session = get_session()
+        if session.graphics_layout is None:
+            session.graphics_layout = GraphicsLayout(
+                addresses.new_monster_graphics, addresses.new_comp8_pointer)
+        return session.graphics_layout
+
+    @classmethod
+    def pack_graphics(cls):
+        layout = cls.get_graphics_layout()
+        layout.pack([mso.graphics_data for mso in cls.every
+                     if not mso.pair_protected])
+        print('INFO: %s' % layout.report())
+        if layout.remaining <= 0:
+            raise Exception('Not enough space for monster graphics: '
+                            '%x bytes needed, %x available.'
+                            % (layout.used, layout.capacity))
+        return layout
+
+    @classmethod
+    def write_graphics(cls, filename):
+        layout = cls.get_graphics_layout()
+        assert layout.remaining >= 0
+        f = get_open_file(filename)
+        for (offset, data) in layout.get_writes():
+            f.seek(layout.start + offset)
+            f.write(data)
 
     def remap_palette(self, data, rgb_palette):
-        zipped = zip(rgb_palette[0::3],
-                     rgb_palette[1::3],
-                     rgb_palette[2::3])
-        pal = enumerate(zipped)
-        pal = sorted(pal, key=lambda x: (x[1], x[0]))
-        old_vals = set(data)
-        assert all([0 <= v <= 0xf for v in old_vals])
-        new_palette = []
-        for new, (old, components) in enumerate(pal):
-            if new == 0:
-                assert new == old
-                assert components == (0, 0, 0)
-            data = data.replace(bytes([old]), bytes([new | 0x80]))
-            new_palette.append(components)
-        for value in set(data):
-            data = data.replace(bytes([value]), bytes([value & 0x7f]))
-        new_palette = [v for vs in new_palette for v in vs]
-        new_vals = set(data)
-        assert len(old_vals) == len(new_vals)
-        assert all([0 <= v <= 0xf for v in new_vals])
-        assert set(rgb_palette) == set(new_palette)
-        return data, new_palette
+        return remap_palette(data, rgb_palette)
 
     def load_image(self, image, transparency=None,
                    preserve_palette_order=False):
         if self.is_super_protected:
             return
-        if isinstance(image, str):
-            image = Image.open(image)
-        if hasattr(image, 'filename') and image.fp is None:
-            image = Image.open(image.filename)
-        if image.mode != 'P':
-            filename = image.filename
-            image = image.convert(mode='P')
-            image.filename = filename
-
-        self._image = image
-        assert self.image == image
-
-        width, height = image.size
-        assert width <= 128
-        assert height <= 128
-        is_big = width > 64 or height > 64
-        if is_big:
+
+        is_default = (isinstance(image, ImageRecord) and transparency is None
+                      and not preserve_palette_order)
+        session = get_session()
+        cache = session.sprite_cache
+        use_cache = is_default and cache is not None
+        source = image
+        record = None
+        if is_default and image.filename in session.sprite_records:
+            record = session.sprite_records[image.filename]
+        elif use_cache:
+            record = cache.get(source)
+        if isinstance(record, Exception):
+            return session.reject(source.filename, record)
+
+        if record is None and is_default:
+            # An image that cannot be a sprite is rejected here as it
+            # would have been up front, and is not decoded again.
+            try:
+                with source.open() as image:
+                    record = prepare_sprite(image)
+            except Exception as e:
+                record = e
+            if record is None:
+                record = Exception('Too many colors.')
+            if use_cache:
+                cache.put(source, record)
+            if isinstance(record, Exception):
+                return session.reject(source.filename, record)
+        elif record is None:
+            if isinstance(image, str):
+                image = Image.open(image)
+            if isinstance(image, ImageRecord):
+                image = image.open()
+            if (hasattr(image, 'filename')
+                    and getattr(image, 'fp', False) is None):
+                image = Image.open(image.filename)
+            record = prepare_sprite(
+                image, transparency=transparency,
+                preserve_palette_order=preserve_palette_order)
+            if record is None:
+                return False
+
+        if record.is_wasteful:
+            print('Wasteful palette: %s' % record.filename)
+
+        if record.is_big:
             self.misc_palette_index |= 0x80
         else:
             self.misc_palette_index &= 0x7f
-        assert self.is_big == is_big
-
-        palette_indexes = set(image.tobytes())
-        if max(palette_indexes) > 0xf:
-            print('INFO: %s has too many colors.' % image.filename)
-            return False
+        assert self.is_big == record.is_big
 
-        is_8color = max(palette_indexes) <= 7
-        if (len(palette_indexes) <= 8 and not is_8color
-                and hasattr(image, 'filename')):
-            print('Wasteful palette: %s' % image.filename)
-        if is_8color:
+        if record.is_8color:
             self.misc_sprite_pointer |= 0x8000
         else:
             self.misc_sprite_pointer &= 0x7fff
-        assert self.is_8color == is_8color
-
-        if transparency is None:
-            border = (
-                [self.image.getpixel((0, j)) for j in range(height)] +
-                [self.image.getpixel((width-1, j)) for j in range(height)] +
-                [self.image.getpixel((i, 0)) for i in range(width)] +
-                [self.image.getpixel((i, height-1)) for i in range(width)])
-            transparency = Counter(border).most_common(1)[0][0]
-
-        palette = self.image.getpalette()
-        if transparency != 0:
-            data = self.image.tobytes()
-            data = data.replace(b'\x00', b'\xff')
-            data = data.replace(bytes([transparency]), b'\x00')
-            data = data.replace(b'\xff', bytes([transparency]))
-            self.image.frombytes(data)
-            index = 3 * transparency
-            temp = palette[index:index+3]
-            assert len(temp) == 3
-            palette[index:index+3] = palette[0:3]
-            palette[0:3] = temp
-        palette[0:3] = [0, 0, 0]
-        num_colors = 8 if self.is_8color else 16
-        self.image.putpalette(palette)
-        self._palette = palette[:3*num_colors]
-        assert self.palette == palette[:3*num_colors]
-
-        done_flag = False
-        while hasattr(self.image, 'filename'):
-            if done_flag:
-                break
-            for j in range(7,-1,-1):
-                if done_flag:
-                    break
-                for i in range(width):
-                    pixel = self.image.getpixel((i, j))
-                    if pixel:
-                        done_flag = True
-                        break
-            else:
-                if not done_flag:
-                    height = self.image.height
-                    if height <= 8:
-                        raise Exception('Fully transparent image not allowed.')
-                    image = self.image.crop(
-                        (0, 8, self.image.width, self.image.height))
-                    image.filename = self.image.filename
-                    self._image = image
-                    new_height = self.image.height
-                    assert height == new_height + 8
-
-        blank_tile = [[0]*8]*8
-        new_tiles = []
-        stencil = []
-        if self.is_big:
-            num_tiles_width = 16
-        else:
-            num_tiles_width = 8
+        assert self.is_8color == record.is_8color
 
-        data = self.image.tobytes()
-        remapped = self.remap_palette(data, self.palette)
-        if not preserve_palette_order:
-            data, self._palette = remapped
-
-        for jj in range(num_tiles_width):
-            stencil_value = 0
-            for ii in range(num_tiles_width):
-                tile = []
-                for j in range(8):
-                    row = []
-                    y = (jj*8) + j
-                    for i in range(8):
-                        x = (ii*8) + i
-                        if x >= self.image.width:
-                            row.append(0)
-                            continue
-                        try:
-                            row.append(int(data[(y*self.image.width) + x]))
-                        except IndexError:
-                            row.append(0)
-                    tile.append(row)
-                if tile == blank_tile:
-                    pass
-                else:
-                    new_tiles.append(tile)
-                    stencil_value |= (1 << (num_tiles_width-(ii+1)))
-            if self.is_big:
-                stencil_value = ((stencil_value >> 8) |
-                                 ((stencil_value & 0xff) << 8))
-            stencil.append(stencil_value)
-
-        self._tiles = new_tiles
-        self._stencil = stencil
+        for attr in ['_image', '_tiles', '_graphics_data']:
+            if hasattr(self, attr):
+                delattr(self, attr)
+        self.image_filename = record.filename
+        self._palette = list(record.palette)
+        self._tile_pixels = record.pixels
+        self._stencil = list(record.stencil)
+        self.encode()
 
         return True
 
@@ -558,23 +1677,37 @@ class MonsterSpriteObject(TableObject):
         if filename is None:
             filename = self.filename
 
-        self.image
+        self.encode()
 
-        chosen_palette = MonsterPaletteObject.get_free()
-        chosen_palette.set_from_rgb(self.palette, is_8color=self.is_8color)
+        allocator = MonsterPaletteObject.get_allocator()
+        colors = MonsterPaletteObject.get_colors(self.palette, self.is_8color)
+        index = allocator.find(colors)
+        self.palette_reused = index is not None
+        if self.palette_reused:
+            chosen_palette = MonsterPaletteObject.get(index)
+        else:
+            chosen_palette = MonsterPaletteObject.get_free(self.is_8color)
+            chosen_palette.set_from_rgb(self.palette,
+                                        is_8color=self.is_8color)
 
         self.misc_palette_index &= 0xFC
         self.misc_palette_index |= (chosen_palette.index >> 8)
         self.low_palette_index = chosen_palette.index & 0xff
         assert self.palette_index == chosen_palette.index
 
-        for mso in MonsterSpriteObject.every:
-            if self.pair_protected:
-                break
-            if (hasattr(mso, 'written') and mso.written
-                    and mso.stencil == self.stencil):
-                self.stencil_index = mso.stencil_index
-                break
+        session = get_session()
+        written_stencils = session.written_stencils
+        stencil_key = tuple(self.stencil)
+
+        self.stencil_reused = bool(self.pair_protected
+                                   or stencil_key in written_stencils)
+        if self.pair_protected:
+            pass
+        elif stencil_key in written_stencils:
+            self.stencil_index = written_stencils[stencil_key]
+        elif session.stencil_tables is not None:
+            self.stencil_index = session.stencil_tables.add(self.stencil,
+                                                            self.is_big)
         else:
             assert self.pair_protected is None
             if self.is_big:
@@ -585,52 +1718,14 @@ class MonsterSpriteObject(TableObject):
             self.stencil_index = mco.new_index
         assert self.stencil_index <= 0xff
 
-        if not hasattr(MonsterSpriteObject, 'free_space'):
-            MonsterSpriteObject.free_space = addresses.new_monster_graphics
-
-        for mso in MonsterSpriteObject.every:
-            if self.pair_protected:
-                break
-            if (hasattr(mso, 'written') and mso.written
-                    and mso.stencil == self.stencil
-                    and mso.tiles == self.tiles):
-                self.misc_sprite_pointer = mso.misc_sprite_pointer
-                break
-        else:
-            assert self.pair_protected is None
-            DIVISION_FACTOR = 16
-            remainder = MonsterSpriteObject.free_space % DIVISION_FACTOR
-            if remainder:
-                MonsterSpriteObject.free_space += (DIVISION_FACTOR - remainder)
-            assert not MonsterSpriteObject.free_space % DIVISION_FACTOR
-
-            pointer = (MonsterSpriteObject.free_space -
-                       addresses.new_monster_graphics)
-            pointer //= DIVISION_FACTOR
-            assert 0 <= pointer <= 0x7fff
-
+        self.graphics_written = 0
+        if self.pair_protected is None:
+            layout = self.get_graphics_layout()
+            graphics = self.graphics_data
+            pointer = layout.get_pointer(graphics)
+            self.graphics_written = layout.claim(graphics)
             self.misc_sprite_pointer &= 0x8000
             self.misc_sprite_pointer |= pointer
-            check = (((self.misc_sprite_pointer & 0x7FFF) * DIVISION_FACTOR)
-                     + addresses.new_monster_graphics)
-            assert check == MonsterSpriteObject.free_space
-            remainder = MonsterSpriteObject.free_space % DIVISION_FACTOR
-            if remainder:
-                MonsterSpriteObject.free_space += (DIVISION_FACTOR - remainder)
-
-            f = get_open_file(filename)
-            f.seek(MonsterSpriteObject.free_space)
-            data = bytes([v for tile in self.tiles
-                          for v in self.interleave_tile(tile)])
-            f.write(data)
-
-            if self.is_8color:
-                MonsterSpriteObject.free_space += (len(self.tiles) * 24)
-            else:
-                MonsterSpriteObject.free_space += (len(self.tiles) * 32)
-
-            assert f.tell() == MonsterSpriteObject.free_space
-            assert MonsterSpriteObject.free_space < addresses.new_comp8_pointer
 
         if self.pair_protected is not None:
             assert self.pair_protected.written
@@ -638,35 +1733,28 @@ class MonsterSpriteObject(TableObject):
                          'misc_palette_index', 'low_palette_index']:
                 setattr(self, attr, getattr(self.pair_protected, attr))
 
+        written_stencils.setdefault(stencil_key, self.stencil_index)
+
         super().write_data(filename)
         self.written = True
 
 
 class MonsterPaletteObject(TableObject):
     after_order = [MonsterSpriteObject]
-    new_palettes = []
+
+    def read_data(self, filename=None, pointer=None):
+        if get_session().remonstered:
+            pointer = (addresses.new_palette_pointer
+                       + (self.index * self.specs.total_size))
+        super().read_data(filename, pointer)
 
     @property
     def successor(self):
         return MonsterPaletteObject.get(self.index + 1)
 
-    @cached_property
+    @property
     def rgb_palette(self):
-        multiplier = 0xff / 0x1f
-        rgbs = []
-        for c in self.colors + self.successor.colors:
-            r = c & 0x1f
-            g = (c >> 5) & 0x1f
-            b = (c >> 10) & 0x1f
-            a = (c >> 15)
-            assert not a
-            if a:
-                r, g, b = 0, 0, 0
-            r = int(round(multiplier * r))
-            g = int(round(multiplier * g))
-            b = int(round(multiplier * b))
-            rgbs.append((r, g, b))
-        return rgbs
+        return colors_to_rgb(self.colors + self.successor.colors)
 
     def compare_palette(self, palette, is_8color):
         if is_8color:
@@ -683,52 +1771,39 @@ class MonsterPaletteObject(TableObject):
                     return True
                 index += 1
 
+    @staticmethod
+    def get_colors(rgb_palette, is_8color):
+        # The 15-bit colors of an RGB palette: 8 of them, or 16.
+        palette = rgb_to_colors(rgb_palette[:24 if is_8color else 48])
+        assert len(palette) == (8 if is_8color else 16)
+        return palette
+
     def set_from_rgb(self, rgb_palette, is_8color):
-        if 'rgb_palette' in self._property_cache:
-            del(self._property_cache['rgb_palette'])
-
-        multiplier = 0x1f / 0xff
-        rgb_palette = rgb_palette[:48]
-        zipped = zip(rgb_palette[0::3],
-                     rgb_palette[1::3],
-                     rgb_palette[2::3])
-        palette = []
-        for (r, g, b) in zipped:
-            r = int(round(multiplier * r))
-            g = int(round(multiplier * g))
-            b = int(round(multiplier * b))
-            assert 0 <= r <= 0x1f
-            assert 0 <= g <= 0x1f
-            assert 0 <= b <= 0x1f
-            c = r | (g << 5) | (b << 10)
-            palette.append(c)
-
-        assert len(palette) >= 8
+        palette = self.get_colors(rgb_palette, is_8color)
+        allocator = self.get_allocator()
         self.colors = palette[:8]
         if not is_8color:
-            assert len(palette) == 16
-            assert self.successor not in MonsterPaletteObject.new_palettes
+            assert self.successor.index not in allocator.used
             self.successor.colors = palette[8:]
-            MonsterPaletteObject.new_palettes.append(self.successor)
+        allocator.add(self.index, palette)
 
     @classmethod
-    def get_free(cls):
-        if not hasattr(MonsterPaletteObject, 'last_index'):
-            MonsterPaletteObject.last_index = -1
-        index = MonsterPaletteObject.last_index
-        while True:
-            index += 1
-            mpo = MonsterPaletteObject.get(index)
-            if mpo not in MonsterPaletteObject.new_palettes:
-                MonsterPaletteObject.last_index = mpo.index
-                MonsterPaletteObject.new_palettes.append(mpo)
-                return mpo
+    def get_allocator(cls):
+        session = get_session()
+        if session.palette_allocator is None:
+            session.palette_allocator = PaletteAllocator(len(cls.every))
+        return session.palette_allocator
+
+    @classmethod
+    def get_free(cls, is_8color=True):
+        index = cls.get_allocator().get_free(is_8color)
+        return MonsterPaletteObject.get(index)
 
     def write_data(self, filename=None):
         if filename is None:
             filename = self.filename
         if (self.index < addresses.previous_max_palettes
-                or self in self.new_palettes):
+                or self.index in self.get_allocator().used):
             new_pointer = (addresses.new_palette_pointer
                            + (self.index * len(self.colors) * 2))
             assert (new_pointer + (len(self.colors)*2)
@@ -764,10 +1839,11 @@ class MonsterComp16Object(MonsterCompMixin):
     def write_data(self, filename=None):
         if filename is None:
             filename = self.filename
-        if not hasattr(MonsterComp16Object, 'new_base_address'):
+        session = get_session()
+        if session.comp16_base_address is None:
             for mc8 in MonsterComp8Object.every:
                 assert mc8.written
-            MonsterComp16Object.new_base_address = max(
+            session.comp16_base_address = max(
                 [mc8.pointer for mc8 in MonsterComp8Object.every]) + 8
 
             f = get_open_file(filename)
@@ -775,13 +1851,13 @@ class MonsterComp16Object(MonsterCompMixin):
             pointer = MonsterComp8Object.get(0).pointer & 0xffff
             f.write(pointer.to_bytes(2, byteorder='little'))
             f.seek(addresses.new_comp16_pointer)
-            pointer = MonsterComp16Object.new_base_address & 0xffff
+            pointer = session.comp16_base_address & 0xffff
             f.write(pointer.to_bytes(2, byteorder='little'))
 
         if self.new_index >= 0:
-            self.pointer = MonsterComp16Object.new_base_address + (
+            self.pointer = session.comp16_base_address + (
                 self.new_index * len(self.stencil) * 2)
-            assert (MonsterComp16Object.new_base_address <= self.pointer
+            assert (session.comp16_base_address <= self.pointer
                     < addresses.new_palette_pointer - len(self.stencil))
 
         super().write_data(filename)
@@ -794,81 +1870,574 @@ def nuke():
                        addresses.monster_graphics))
 
 
-def begin_remonster(outfile, seed, rom_type=None):
-    global ALL_OBJECTS
-
-    if rom_type in ('1.0', '1.1'):
-        label = 'FF6_NA_%s' % rom_type
-        set_global_label(label)
-        tables_list = ('tables_list.txt' if rom_type != '1.1'
-                       else 'tables_list_1.1.txt')
-        set_global_table_filename(tables_list)
-    else:
-        table_list = determine_global_table(outfile)
-
-    f = open(outfile, 'r+b')
-    f.seek(0)
-    block = f.read(0x10000)
-    f.seek(0x400000)
-    f.write(block)
-    f.close()
+class RemonsterSession:
+    # Owns everything one remonstering run changes: the images already
+    # used, the graphics layout, written stencils, allocated palettes and
+    # the table objects themselves, along with the image pack it draws
+    # from. The table classes reach it through get_session(), as
+    # randomtools keeps its objects on the classes.
+    #
+    # The table objects still live on the randomtools classes, and
+    # randomtools and the random module are shared by the whole process,
+    # so only one session can be active at a time. run and reroll hold
+    # LOCK for their whole length: sessions started from several threads
+    # are safe but run one after another, not concurrently. What threads
+    # do share is the image pack, which is only read during a run, so it
+    # is loaded and preprocessed once. For runs that really overlap, use
+    # separate processes.
+    active = None
+    LOCK = RLock()
+
+    def __init__(self, images=(), monster_tags=None, sprite_records=None,
+                 sprite_cache=None):
+        # Images already known not to be sprites are listed in rejected
+        # with the reason why. Only those rejected from their headers are
+        # left out of the pack: they are too large for any monster, so are
+        # never drawn anyway. The rest stay in, so the same images are
+        # drawn with or without a pool, and load_image rejects them
+        # without decoding them.
+        self.monster_tags = monster_tags or {}
+        self.sprite_records = (sprite_records if sprite_records is not None
+                               else {})
+        self.rejected = {filename: get_rejection(record)
+                         for (filename, record) in self.sprite_records.items()
+                         if isinstance(record, Exception)}
+        oversized = validate_images(images)
+        self.images = [image for image in images
+                       if image.filename not in self.rejected
+                       or image.filename not in oversized]
+        self.sprite_cache = sprite_cache
+        self.image_index = ImageIndex(self.images) if self.images else None
+        self.reset()
 
-    set_seed(seed)
-    random.seed(seed)
-
-    set_global_output_filename(outfile)
-
-    ALL_OBJECTS = [
-        g for g in globals().values()
-        if isinstance(g, type) and issubclass(g, TableObject)
-        and g not in [TableObject]]
-
-    set_table_specs(ALL_OBJECTS)
-
-    ALL_OBJECTS = sort_good_order(ALL_OBJECTS)
-    assert ALL_OBJECTS
-
-    for o in ALL_OBJECTS:
-        o.every
-    for o in ALL_OBJECTS:
-        o.ranked
-
-    for index in MonsterSpriteObject.PROTECTED_INDEXES:
-        MonsterSpriteObject.get(index).image
-
-    write_patches(outfile)
-
-
-def finish_remonster():
-    outfile = MonsterSpriteObject.get(0).filename
-    for o in ALL_OBJECTS:
-        o.write_all(outfile)
-
-    close_file(outfile)
-
-    f = open(outfile, 'rb')
-    f.seek(0)
-    block1 = f.read(0x10000)
-    f.seek(0x400000)
-    block81 = f.read(0x10000)
-    f.close()
+    @classmethod
+    def from_data(cls, images, monster_tags=None, processes=None,
+                  streaming=False, validate=True):
+        # images are (name, data, tags) and monster_tags map monster
+        # indexes to tags, in the same form as the tags files.
+        images = sorted([ImageRecord(name, parse_tags(tags), data=data)
+                         for (name, data, tags) in images],
+                        key=lambda i: i.filename)
+        monster_tags = {index: split_monster_tags(parse_tags(tags))
+                        for (index, tags) in (monster_tags or {}).items()}
+        sprite_records = get_sprite_records(
+            images, processes=processes, streaming=streaming,
+            validate=validate)
+        session = cls(images, monster_tags=monster_tags,
+                      sprite_records=sprite_records)
+        session.report_rejected()
+        return session
 
-    assert block1 == block81
+    @classmethod
+    def from_files(cls, images_tags_filename, monsters_tags_filename=None,
+                   cache_dir=None, processes=None, streaming=False,
+                   validate=True):
+        # With processes, every image is converted up front, in that many
+        # worker processes. With streaming, images are converted again when
+        # chosen instead of every conversion being kept in memory; see
+        # preprocess_images. With validate, images too large to be sprites
+        # are found from their headers; any other image that cannot be a
+        # sprite is rejected when it is first chosen.
+        sprite_cache = (SpriteCache(cache_dir) if cache_dir is not None
+                        else None)
+        images = read_images_list(images_tags_filename)
+        monster_tags = None
+        if monsters_tags_filename is not None:
+            monster_tags = read_monster_tags(monsters_tags_filename)
+        sprite_records = get_sprite_records(
+            images, processes=processes, cache=sprite_cache,
+            streaming=streaming, validate=validate)
+        session = cls(images, monster_tags=monster_tags,
+                      sprite_records=sprite_records, sprite_cache=sprite_cache)
+        session.report_rejected()
+        return session
+
+    def report_rejected(self):
+        for filename in sorted(self.rejected):
+            print('INFO: Rejected {0}: {1}'.format(filename,
+                                                   self.rejected[filename]))
+        if self.rejected:
+            filenames = {image.filename for image in self.images}
+            print('INFO: {0} of {1} images rejected.'.format(
+                len(self.rejected), len(filenames | set(self.rejected))))
+
+    def reject(self, filename, record):
+        # An image found not to be a sprite when it was chosen. It stays in
+        # the pack, so the same candidates are drawn from whether or not it
+        # was found before, but it is never decoded again.
+        self.sprite_records[filename] = record
+        self.rejected[filename] = get_rejection(record)
+        print('INFO: Rejected {0}: {1}'.format(filename,
+                                               self.rejected[filename]))
+        return False
 
-    seed = get_seed()
-    f = open('remonster.{0}.txt'.format(seed), 'w+')
-    f.write('ROM: {0}\n'.format(MonsterSpriteObject.get(0).filename))
-    f.write('Seed: {0}\n'.format(get_seed()))
-    for mso in MonsterSpriteObject.every:
-        f.write('{0}\n'.format(mso))
-    f.close()
+    def reset(self):
+        self.done_images = []
+        self.graphics_layout = None
+        self.written_stencils = {}
+        self.palette_allocator = None
+        self.comp16_base_address = None
+        self.all_objects = None
+        self.outfile = None
+        self.rom = None
+        self.manifest = None
+        self.remonstered = False
+        self.stencil_tables = None
+        self.kept_palettes = None
+        self.protected_indexes = None
+        self.timings = {}
+
+    @contextmanager
+    def timed(self, phase):
+        start = time()
+        try:
+            yield
+        finally:
+            self.timings[phase] = self.timings.get(phase, 0) + time() - start
 
+    @property
+    def table_classes(self):
+        return [g for g in globals().values()
+                if isinstance(g, type) and issubclass(g, TableObject)
+                and g not in [TableObject]]
+
+    def clear_objects(self):
+        # Drops the table objects a previous run loaded, along with the
+        # graphics, palette and stencil cached on each of them. randomtools
+        # has no public way to reload its tables, so this clears the caches
+        # its every and ranked properties keep on each class, and its
+        # object registry and ROM label if it has them.
+        classes = self.table_classes
+        for cls in classes:
+            for attr in ['_every', '_ranked']:
+                if attr in cls.__dict__:
+                    delattr(cls, attr)
+        grand_object_dict = getattr(tablereader, 'GRAND_OBJECT_DICT', None)
+        if grand_object_dict:
+            for key in list(grand_object_dict):
+                if isinstance(key, tuple) and key[0] in classes:
+                    del(grand_object_dict[key])
+        if hasattr(tablereader, 'GLOBAL_LABEL'):
+            tablereader.GLOBAL_LABEL = None
+
+    def activate(self):
+        active = RemonsterSession.active
+        if active is not None and active is not self:
+            active.close()
+        self.clear_objects()
+        self.reset()
+        RemonsterSession.active = self
+
+    def begin(self, outfile, seed, rom_type=None, memory_map=False,
+              source=None):
+        # With a source, outfile may also be a writable file object, and
+        # the ROM is built in memory then written to outfile in one go.
+        self.activate()
+
+        with self.timed('rom_load'):
+            rom = None
+            if source is not None:
+                rom = open_rom_source(source, outfile)
+                self.rom = rom
+                outfile = rom.filename
+            self.outfile = outfile
+            self.set_rom_type(rom_type, rom)
+
+            if rom is None and memory_map:
+                rom = open_rom_buffer(outfile)
+            if rom is not None:
+                rom.move(HEADER_MIRROR, 0, HEADER_BLOCK_SIZE)
+            else:
+                f = open(outfile, 'r+b')
+                f.seek(0)
+                block = f.read(HEADER_BLOCK_SIZE)
+                f.seek(HEADER_MIRROR)
+                f.write(block)
+                f.close()
+
+        set_seed(seed)
+        random.seed(seed)
+        with self.timed('table_load'):
+            self.load_tables()
+            for index in MonsterSpriteObject.PROTECTED_INDEXES:
+                MonsterSpriteObject.get(index).image
+
+        with self.timed('patch_write'):
+            write_patches(outfile)
+
+    def set_rom_type(self, rom_type, rom=None):
+        if rom_type in ('1.0', '1.1'):
+            label = 'FF6_NA_%s' % rom_type
+            set_global_label(label)
+            tables_list = ('tables_list.txt' if rom_type != '1.1'
+                           else 'tables_list_1.1.txt')
+            set_global_table_filename(tables_list)
+        elif rom is not None:
+            with rom.view(0, rom.source_size) as data:
+                label, tables_list = identify_rom(data)
+            set_global_label(label)
+            set_global_table_filename(tables_list)
+        else:
+            table_list = determine_global_table(self.outfile)
+
+    def load_tables(self):
+        set_global_output_filename(self.outfile)
+
+        all_objects = self.table_classes
+        set_table_specs(all_objects)
+        all_objects = sort_good_order(all_objects)
+        assert all_objects
+        self.all_objects = all_objects
+
+        for o in all_objects:
+            o.every
+        for o in all_objects:
+            o.ranked
+
+    def begin_reroll(self, outfile, seed, indexes, manifest=None,
+                     rom_type=None, memory_map=False, source=None,
+                     protected=None):
+        # Loads a ROM that was already remonstered, reading its sprites from
+        # where the expansion patch moved them, and frees the graphics,
+        # stencils and palettes used only by the monsters being rerolled.
+        # manifest maps monster indexes to the images already used, as
+        # returned by read_manifest, and protected is the indexes that kept
+        # their own sprite, as returned by read_protected. Returns the
+        # monsters to reroll.
+        self.activate()
+        self.remonstered = True
+
+        with self.timed('rom_load'):
+            rom = None
+            if source is not None:
+                rom = open_rom_source(source, outfile)
+                self.rom = rom
+                outfile = rom.filename
+            self.outfile = outfile
+            if rom is None and memory_map:
+                rom = open_rom_buffer(outfile)
+
+            if rom_type not in ('1.0', '1.1'):
+                rom_type = get_remonstered_type(outfile)
+                if rom_type is None:
+                    raise Exception('%s has not been remonstered.' % outfile)
+            self.set_rom_type(rom_type)
+
+        set_seed(seed)
+        random.seed(seed)
+        with self.timed('table_load'):
+            self.load_tables()
+
+        if protected is None:
+            protected = self.guess_protected()
+        self.protected_indexes = set(protected)
+
+        manifest = manifest or {}
+        if not manifest:
+            print('INFO: No manifest, so images may be used twice.')
+        self.done_images = [manifest[index] for index in sorted(manifest)
+                            if manifest[index] is not None]
+
+        msos = []
+        for index in sorted(set(indexes)):
+            mso = MonsterSpriteObject.get(index)
+            if mso.is_protected:
+                print('INFO: Sprite %x cannot be rerolled.' % index)
+            else:
+                msos.append(mso)
+
+        with self.timed('table_load'):
+            self.stencil_tables = StencilTables(outfile)
+            used8, used16, extents = set([]), set([]), []
+            num_comp16 = 0
+            for mso in MonsterSpriteObject.every:
+                # Rerolled monsters keep this too, in case they find no new
+                # image and keep their sprite.
+                mso.image_filename = manifest.get(mso.index)
+                if mso.is_big:
+                    num_comp16 = max(num_comp16, mso.stencil_index + 1)
+                if mso in msos:
+                    continue
+                if mso.is_big:
+                    used16.add(mso.stencil_index)
+                else:
+                    used8.add(mso.stencil_index)
+                self.written_stencils.setdefault(tuple(mso.stencil),
+                                                 mso.stencil_index)
+                mpo = MonsterPaletteObject.get(mso.palette_index)
+                colors = list(mpo.colors)
+                if not mso.is_8color:
+                    colors += mpo.successor.colors
+                MonsterPaletteObject.get_allocator().add(mpo.index, colors)
+                start = mso.sprite_pointer - addresses.new_monster_graphics
+                size = mso.num_tiles * (24 if mso.is_8color else 32)
+                extents.append((start, start + size))
+            self.stencil_tables.set_used(used8, used16, num_comp16)
+            self.kept_palettes = set(
+                MonsterPaletteObject.get_allocator().used)
+
+            end = max([b for (a, b) in extents], default=0)
+            f = get_open_file(outfile)
+            f.seek(addresses.new_monster_graphics)
+            self.graphics_layout = RerollLayout(
+                addresses.new_monster_graphics, addresses.new_comp8_pointer,
+                f.read(end), extents)
+
+        return msos
+
+    def guess_protected(self):
+        # Without a JSON manifest, the only sprites known to be protected
+        # are the fixed ones, and those still sharing graphics and a
+        # stencil with a super protected sprite. Unseen sprites cannot be
+        # told apart once their pointers have been rewritten.
+        protected = set(MonsterSpriteObject.PROTECTED_INDEXES
+                        + MonsterSpriteObject.SUPER_PROTECTED_INDEXES)
+        for index in MonsterSpriteObject.SUPER_PROTECTED_INDEXES:
+            other = MonsterSpriteObject.get(index)
+            for mso in MonsterSpriteObject.every:
+                if (mso.stencil_index == other.stencil_index
+                        and mso.misc_sprite_pointer
+                        == other.misc_sprite_pointer):
+                    protected.add(mso.index)
+        return protected
+
+    def finish_reroll(self, msos, log=True):
+        # Writes only what the rerolled monsters changed.
+        outfile = self.outfile
+        with self.timed('encode'):
+            layout = MonsterSpriteObject.get_graphics_layout()
+            layout.pack([mso.graphics_data for mso in msos])
+            print('INFO: %s' % layout.report())
+        with self.timed('table_write'):
+            for mso in sorted(msos, key=lambda m: m.index):
+                mso.write_data(outfile)
+            allocator = MonsterPaletteObject.get_allocator()
+            for index in sorted(allocator.used - self.kept_palettes):
+                MonsterPaletteObject.get(index).write_data(outfile)
+            MonsterSpriteObject.write_graphics(outfile)
+            close_file(outfile)
+        print('INFO: %s' % allocator.report())
+
+        self.manifest = self.get_manifest()
+        if log:
+            self.write_log()
+            self.write_json()
+        return self.manifest
+
+    def apply_monster_tags(self):
+        for index, (whitelist, blacklist) in self.monster_tags.items():
+            MonsterSpriteObject.get(index).whitelist = whitelist
+            MonsterSpriteObject.get(index).blacklist = blacklist
 
-def remonsterate(outfile, seed, images_tags_filename,
-                 monsters_tags_filename=None, rom_type=None):
-    seed = int(seed)
-    begin_remonster(outfile, seed, rom_type=rom_type)
+    def select_images(self, msos=None):
+        if msos is None:
+            msos = list(MonsterSpriteObject.every)
+        random.shuffle(msos)
+        with self.timed('selection'):
+            for mso in msos:
+                mso.select_image()
+        self.timings['selection'] -= self.timings.get('image_load', 0)
+
+    def get_stencil_usage(self):
+        if self.stencil_tables is not None:
+            tables = self.stencil_tables
+            num_comp8 = tables.num_comp8 - len(tables.free8)
+            num_comp16 = tables.num_comp16 - len(tables.free16)
+            end = tables.comp16_base + (tables.num_comp16 * 32)
+        else:
+            num_comp8 = len([mco for mco in MonsterComp8Object.every
+                             if mco.new_index >= 0])
+            num_comp16 = len([mco for mco in MonsterComp16Object.every
+                              if mco.new_index >= 0])
+            end = self.comp16_base_address or addresses.new_comp8_pointer
+            end += num_comp16 * 32
+        return {'comp8': num_comp8,
+                'comp16': num_comp16,
+                'remaining': addresses.new_palette_pointer - end}
+
+    def get_manifest(self):
+        images = {image.filename: image for image in self.images}
+        sprites = []
+        for mso in MonsterSpriteObject.every:
+            filename = getattr(mso, 'image_filename', None)
+            image = images.get(filename)
+            graphics_size = mso.num_tiles * (24 if mso.is_8color else 32)
+            graphics_written = getattr(mso, 'graphics_written', None)
+            sprites.append({
+                'index': mso.index,
+                'image': filename,
+                'image_hash': (image.content_hash if image is not None
+                               else None),
+                'tags': sorted(image.tags) if image is not None else [],
+                'is_big': mso.is_big,
+                'is_8color': mso.is_8color,
+                'num_tiles': mso.num_tiles,
+                'graphics_pointer': mso.misc_sprite_pointer & 0x7fff,
+                'graphics_size': graphics_size,
+                'graphics_written': graphics_written,
+                'graphics_reused': (graphics_written == 0
+                                    if graphics_written is not None
+                                    else None),
+                'palette_index': mso.palette_index,
+                'palette_reused': getattr(mso, 'palette_reused', None),
+                'protected': bool(mso.is_protected or mso.pair_protected),
+                'stencil_index': mso.stencil_index,
+                'stencil_reused': getattr(mso, 'stencil_reused', None),
+                })
+        layout = MonsterSpriteObject.get_graphics_layout()
+        palettes = MonsterPaletteObject.get_allocator()
+        return {
+            'version': VERSION,
+            'rom': self.outfile,
+            'seed': get_seed(),
+            'sprites': sprites,
+            'graphics': {'capacity': layout.capacity,
+                         'used': layout.used,
+                         'remaining': layout.remaining,
+                         'padding': layout.padding},
+            'stencils': self.get_stencil_usage(),
+            'palettes': {'used': len(palettes.used),
+                         'remaining': palettes.remaining,
+                         'shared': palettes.shared,
+                         'capacity': palettes.capacity},
+            'rejected': dict(self.rejected),
+            'timings': dict(self.timings),
+            }
+
+    def write_json(self, filename=None):
+        manifest = self.manifest
+        if filename is None:
+            filename = 'remonster.{0}.json'.format(manifest['seed'])
+        with open(filename, 'w+') as f:
+            json.dump(manifest, f, indent=1)
 
+    def write_log(self, filename=None):
+        manifest = self.manifest
+        if filename is None:
+            filename = 'remonster.{0}.txt'.format(manifest['seed'])
+        f = open(filename, 'w+')
+        f.write('ROM: {0}\n'.format(manifest['rom']))
+        f.write('Seed: {0}\n'.format(manifest['seed']))
+        for sprite in manifest['sprites']:
+            f.write('{0:0>3X} {1}\n'.format(sprite['index'],
+                                            sprite['image'] or '---'))
+        f.close()
+
+    def finish(self, log=True):
+        # Writes the ROM and returns the manifest of the sprites chosen.
+        # The manifest is also written to remonster.<seed>.txt and
+        # remonster.<seed>.json unless log is False.
+        outfile = self.outfile
+        with self.timed('encode'):
+            MonsterSpriteObject.pack_graphics()
+        with self.timed('table_write'):
+            for o in self.all_objects:
+                o.write_all(outfile)
+            MonsterSpriteObject.write_graphics(outfile)
+        print('INFO: %s' % MonsterPaletteObject.get_allocator().report())
+
+        with self.timed('verification'):
+            f = get_open_file(outfile)
+            if isinstance(f, RomBuffer):
+                with f.view(0, HEADER_BLOCK_SIZE) as block1, \
+                        f.view(HEADER_MIRROR, HEADER_BLOCK_SIZE) as block81:
+                    assert block1 == block81
+                close_file(outfile)
+            else:
+                close_file(outfile)
+
+                f = open(outfile, 'rb')
+                f.seek(0)
+                block1 = f.read(HEADER_BLOCK_SIZE)
+                f.seek(HEADER_MIRROR)
+                block81 = f.read(HEADER_BLOCK_SIZE)
+                f.close()
+
+                assert block1 == block81
+
+        self.manifest = self.get_manifest()
+        if log:
+            self.write_log()
+            self.write_json()
+        return self.manifest
+
+    def close(self):
+        # A ROM built in memory is written by finish or finish_reroll; if
+        # neither got that far, it is discarded instead of left half built.
+        if self.rom is not None:
+            self.rom.discard()
+        elif self.outfile is not None:
+            close_file(self.outfile)
+        if RemonsterSession.active is self:
+            self.clear_objects()
+            RemonsterSession.active = None
+        self.reset()
+
+    def reroll(self, outfile, seed, indexes, manifest=None, rom_type=None,
+               memory_map=False, source=None, log=True, protected=None):
+        with RemonsterSession.LOCK:
+            try:
+                msos = self.begin_reroll(
+                    outfile, int(seed), indexes, manifest=manifest,
+                    rom_type=rom_type, memory_map=memory_map, source=source,
+                    protected=protected)
+                self.apply_monster_tags()
+                self.select_images(msos)
+                return self.finish_reroll(msos, log=log)
+            finally:
+                self.close()
+
+    def run(self, outfile, seed, rom_type=None, memory_map=False,
+            source=None, log=True):
+        with RemonsterSession.LOCK:
+            try:
+                self.begin(outfile, int(seed), rom_type=rom_type,
+                           memory_map=memory_map, source=source)
+                self.apply_monster_tags()
+                self.select_images()
+                return self.finish(log=log)
+            finally:
+                self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def get_remonstered_type(filename):
+    # The ROM version whose expansion patch has been applied, if any.
+    f = get_open_file(filename)
+    for rom_type, pointer in [('1.0', 0x1217a), ('1.1', 0x1216e)]:
+        f.seek(pointer)
+        if f.read(4) == b'\x6f\x20\xa8\x5f':
+            return rom_type
+    return None
+
+
+def get_session():
+    if RemonsterSession.active is None:
+        raise Exception('No remonster session is active.')
+    return RemonsterSession.active
+
+
+def parse_tags(tags):
+    if not tags:
+        return set([])
+    if isinstance(tags, str):
+        tags = tags.split(',')
+    return {t for t in tags if t.strip()}
+
+
+def split_monster_tags(tags):
+    # Returns (whitelist, blacklist); blacklisted tags start with "!".
+    whitelist = {t for t in tags if not t.startswith('!')}
+    blacklist = {t[1:] for t in tags if t.startswith('!')}
+    return whitelist, blacklist
+
+
+def read_images_list(images_tags_filename):
     images = []
     for line in open(images_tags_filename):
         if '#' in line:
@@ -878,37 +2447,166 @@ def remonsterate(outfile, seed, images_tags_filename,
             continue
         if ':' in line:
             image_filename, tags = line.split(':')
-            tags = tags.split(',')
-            tags = {t for t in tags if t.strip()}
+            tags = parse_tags(tags)
         else:
             image_filename, tags = line, set([])
-        image = Image.open(image_filename)
-        image.tags = tags
-        image.close()
-        images.append(image)
-
-    if monsters_tags_filename is not None:
-        for line in open(monsters_tags_filename):
-            if '#' in line:
-                line, comment = line.split('#', 1)
-            line = line.strip()
-            if ':' not in line:
-                continue
-            index, tags = line.split(':')
-            index = int(index, 0x10)
-            tags = tags.split(',')
-            tags = {t for t in tags if t.strip()}
-            whitelist = {t for t in tags if not t.startswith('!')}
-            blacklist = {t[1:] for t in tags if t.startswith('!')}
-            MonsterSpriteObject.get(index).whitelist = whitelist
-            MonsterSpriteObject.get(index).blacklist = blacklist
+        images.append(ImageRecord(image_filename, tags))
+    return sorted(images, key=lambda i: i.filename)
 
-    MonsterSpriteObject.import_images = sorted(images,
-                                               key=lambda i: i.filename)
 
-    msos = list(MonsterSpriteObject.every)
-    random.shuffle(msos)
-    for mso in msos:
-        mso.select_image()
+def read_monster_tags(monsters_tags_filename):
+    monster_tags = {}
+    for line in open(monsters_tags_filename):
+        if '#' in line:
+            line, comment = line.split('#', 1)
+        line = line.strip()
+        if ':' not in line:
+            continue
+        index, tags = line.split(':')
+        index = int(index, 0x10)
+        monster_tags[index] = split_monster_tags(parse_tags(tags))
+    return monster_tags
+
+
+def read_manifest(manifest_filename):
+    # Reads a remonster.<seed>.txt or .json log back into
+    # {index: image filename}, with None for monsters that kept their own
+    # sprite.
+    if manifest_filename.endswith('.json'):
+        with open(manifest_filename) as f:
+            sprites = json.load(f)['sprites']
+        return {sprite['index']: sprite['image'] for sprite in sprites}
+
+    manifest = {}
+    for line in open(manifest_filename):
+        line = line.rstrip('\n')
+        if not line or line.split(' ')[0].endswith(':'):
+            continue
+        index, image_filename = line.split(' ', 1)
+        if image_filename == '---':
+            image_filename = None
+        manifest[int(index, 0x10)] = image_filename
+    return manifest
+
+
+def read_protected(manifest_filename):
+    # The indexes of the monsters that kept their own sprite, from a
+    # remonster.<seed>.json log, or from the .json written alongside a
+    # .txt one. None if there is no such log or it predates this field.
+    json_filename = os.path.splitext(manifest_filename)[0] + '.json'
+    if not os.path.exists(json_filename):
+        return None
+    with open(json_filename) as f:
+        sprites = json.load(f)['sprites']
+    if not all(['protected' in sprite for sprite in sprites]):
+        return None
+    return {sprite['index'] for sprite in sprites if sprite['protected']}
+
 
-    finish_remonster()
+def read_jobs_list(jobs_filename):
+    # Each line is: rom_filename seed [output_filename]
+    jobs = []
+    for line in open(jobs_filename):
+        if '#' in line:
+            line, comment = line.split('#', 1)
+        line = line.split()
+        if not line:
+            continue
+        rom_filename, seed = line[:2]
+        output_filename = line[2] if len(line) > 2 else None
+        jobs.append((rom_filename, seed, output_filename))
+    return jobs
+
+
+def begin_remonster(outfile, seed, rom_type=None, memory_map=False,
+                    source=None, session=None):
+    if session is None:
+        session = RemonsterSession()
+    session.begin(outfile, seed, rom_type=rom_type, memory_map=memory_map,
+                  source=source)
+    return session
+
+
+def finish_remonster(session=None, log=True):
+    if session is None:
+        session = get_session()
+    return session.finish(log=log)
+
+
+def remonsterate(outfile, seed, images_tags_filename,
+                 monsters_tags_filename=None, rom_type=None, memory_map=False,
+                 cache_dir=None, processes=None, source=None,
+                 streaming=False, validate=True):
+    # Modifies outfile in place, unless a source ROM (a filename or bytes)
+    # is given, in which case outfile is only written, once, at the end.
+    session = RemonsterSession.from_files(
+        images_tags_filename, monsters_tags_filename,
+        cache_dir=cache_dir, processes=processes, streaming=streaming,
+        validate=validate)
+    session.run(outfile, seed, rom_type=rom_type, memory_map=memory_map,
+                source=source)
+
+
+def reroll_monsters(outfile, seed, indexes, images_tags_filename,
+                    monsters_tags_filename=None, manifest_filename=None,
+                    rom_type=None, memory_map=False, cache_dir=None,
+                    processes=None, source=None, streaming=False,
+                    validate=True):
+    # Picks new images for just the given monsters of a ROM that was
+    # already remonstered. indexes may be a string of hex indexes
+    # separated by commas.
+    if isinstance(indexes, str):
+        indexes = [int(index, 0x10) for index in indexes.split(',')
+                   if index.strip()]
+    manifest, protected = None, None
+    if manifest_filename is not None:
+        manifest = read_manifest(manifest_filename)
+        protected = read_protected(manifest_filename)
+    session = RemonsterSession.from_files(
+        images_tags_filename, monsters_tags_filename,
+        cache_dir=cache_dir, processes=processes, streaming=streaming,
+        validate=validate)
+    return session.reroll(outfile, seed, indexes, manifest=manifest,
+                          rom_type=rom_type, memory_map=memory_map,
+                          source=source, protected=protected)
+
+
+def remonsterate_batch(jobs, images_tags_filename,
+                       monsters_tags_filename=None, rom_type=None,
+                       memory_map=False, cache_dir=None, processes=None,
+                       streaming=False, validate=True):
+    # Runs many (rom_filename, seed, output_filename) jobs in one process,
+    # sharing the image pack. Jobs with an output filename read their ROM
+    # as a source and leave it untouched; jobs without one are modified in
+    # place.
+    session = RemonsterSession.from_files(
+        images_tags_filename, monsters_tags_filename,
+        cache_dir=cache_dir, processes=processes, streaming=streaming,
+        validate=validate)
+
+    for rom_filename, seed, output_filename in jobs:
+        source = None
+        if output_filename is not None:
+            source = rom_filename
+        else:
+            output_filename = rom_filename
+        session.run(output_filename, seed, rom_type=rom_type,
+                    memory_map=memory_map, source=source)
+        print('Finished {0} with seed {1}.'.format(output_filename, seed))
+
+
+def remonsterate_bytes(rom, seed, images, monster_tags=None, rom_type=None,
+                       processes=None, streaming=False, validate=True):
+    # Everything in memory: rom is the source ROM's bytes, images are
+    # (name, data, tags) and monster_tags map monster indexes to tags, e.g.
+    # {0x10: 'humanoid,!big'}. Returns the new ROM's bytes and the
+    # manifest. Nothing but the package's own tables is read from disk.
+    session = RemonsterSession.from_data(images, monster_tags,
+                                         processes=processes,
+                                         streaming=streaming,
+                                         validate=validate)
+    output = BytesIO()
+    manifest = session.run(output, seed, rom_type=rom_type, source=rom,
+                           log=False)
+    manifest['rom'] = None
+    return output.getvalue(), manifest
@@ -1,7 +1,10 @@
 import tkinter, os
 from tkinter import ttk
 from tkinter import messagebox
-from remonsterate.remonsterate import remonsterate, VERSION
+from remonsterate.remonsterate import (
+    remonsterate, remonsterate_batch, reroll_monsters, read_jobs_list,
+    VERSION)
+from multiprocessing import freeze_support
 from sys import argv, stdout
 from traceback import format_exc
 from time import time, sleep
@@ -216,9 +219,19 @@ class RemonstrateGUI(tkinter.Frame):
 
 
 if __name__ == '__main__':
+    freeze_support()
     root = None
     try:
-        if len(argv) > 3:
+        if len(argv) > 3 and argv[1] == '--batch':
+            # run.py --batch <jobs file> <images file> [monsters file]
+            remonsterate_batch(read_jobs_list(argv[2]), *argv[3:])
+            print('Finished successfully.')
+        elif len(argv) > 5 and argv[1] == '--reroll':
+            # run.py --reroll <rom> <seed> <hex indexes, comma separated>
+            #        <images file> [monsters file] [remonster.<seed>.txt]
+            reroll_monsters(*argv[2:])
+            print('Finished successfully.')
+        elif len(argv) > 3:
             remonsterate(*argv[1:])
             print('Finished successfully.')
         else:
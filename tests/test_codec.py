@@ -0,0 +1,88 @@
+import random
+import unittest
+
+from remonsterate.remonsterate import (
+    BITPLANE_SPREAD, BITPLANE_GATHER, deinterleave_tiles, interleave_tiles,
+    pixels_to_tiles, tiles_to_pixels, Tile)
+
+
+def reference_deinterleave(data, is_8color):
+    # One pixel at a time, straight from the SNES bitplane layout.
+    numbytes = 24 if is_8color else 32
+    pixels = bytearray()
+    for t in range(0, len(data), numbytes):
+        for y in range(8):
+            planes = [data[t+(y*2)], data[t+(y*2)+1]]
+            if is_8color:
+                planes.append(data[t+16+y])
+            else:
+                planes += [data[t+16+(y*2)], data[t+16+(y*2)+1]]
+            for x in range(8):
+                bit = 7 - x
+                pixels.append(sum([((p >> bit) & 1) << i
+                                   for (i, p) in enumerate(planes)]))
+    return bytes(pixels)
+
+
+class TestBitplaneTables(unittest.TestCase):
+    def test_gather_inverts_spread(self):
+        self.assertEqual(len(BITPLANE_SPREAD), 0x100)
+        for v in range(0x100):
+            self.assertEqual(BITPLANE_GATHER[BITPLANE_SPREAD[v]], v)
+
+    def test_spread_puts_msb_first(self):
+        self.assertEqual(BITPLANE_SPREAD[0x80].to_bytes(8, 'big'),
+                         b'\x01' + bytes(7))
+        self.assertEqual(BITPLANE_SPREAD[0x01].to_bytes(8, 'big'),
+                         bytes(7) + b'\x01')
+
+
+class TestCodec(unittest.TestCase):
+    def setUp(self):
+        self.random = random.Random(0)
+
+    def random_data(self, num_tiles, is_8color):
+        numbytes = 24 if is_8color else 32
+        return bytes([self.random.randrange(0x100)
+                      for _ in range(num_tiles * numbytes)])
+
+    def test_matches_reference(self):
+        for is_8color in (True, False):
+            data = self.random_data(16, is_8color)
+            self.assertEqual(deinterleave_tiles(data, is_8color),
+                             reference_deinterleave(data, is_8color))
+
+    def test_round_trip(self):
+        for is_8color in (True, False):
+            data = self.random_data(64, is_8color)
+            pixels = deinterleave_tiles(data, is_8color)
+            self.assertEqual(len(pixels), 64 * 64)
+            self.assertLessEqual(max(pixels), 7 if is_8color else 0xf)
+            self.assertEqual(interleave_tiles(pixels, is_8color), data)
+
+    def test_pixels_round_trip(self):
+        for is_8color in (True, False):
+            top = 8 if is_8color else 16
+            pixels = bytes([self.random.randrange(top)
+                            for _ in range(64 * 8)])
+            data = interleave_tiles(pixels, is_8color)
+            self.assertEqual(deinterleave_tiles(data, is_8color), pixels)
+
+    def test_partial_tile_ignored(self):
+        data = self.random_data(2, True)
+        self.assertEqual(deinterleave_tiles(data + b'\xff' * 5, True),
+                         deinterleave_tiles(data, True))
+
+    def test_tiles_view(self):
+        pixels = bytes([self.random.randrange(16) for _ in range(64 * 3)])
+        tiles = pixels_to_tiles(pixels)
+        self.assertTrue(all([isinstance(tile, Tile) for tile in tiles]))
+        lists = [[list(row) for row in tile] for tile in tiles]
+        self.assertEqual(tiles, lists)
+        self.assertEqual(tiles_to_pixels(tiles), pixels)
+        self.assertEqual(tiles_to_pixels(lists), pixels)
+        self.assertEqual(len(set(tiles + pixels_to_tiles(pixels))), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
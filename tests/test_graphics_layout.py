@@ -0,0 +1,117 @@
+import unittest
+
+from remonsterate.remonsterate import GraphicsLayout, RerollLayout
+
+
+def block(value, length):
+    return bytes([(value + i) & 0xff for i in range(length)])
+
+
+class TestGraphicsLayout(unittest.TestCase):
+    def setUp(self):
+        self.layout = GraphicsLayout(0x580000, 0x580400)
+
+    def test_identical_graphics_shared(self):
+        a = block(1, 48)
+        self.assertEqual(self.layout.place(a), 0)
+        self.assertEqual(self.layout.place(a), 0)
+        self.assertEqual(self.layout.used, 48)
+        self.assertEqual(self.layout.claim(a), 48)
+        self.assertEqual(self.layout.claim(a), 0)
+
+    def test_found_inside_at_aligned_offset(self):
+        a = block(1, 64)
+        self.layout.place(a)
+        self.assertEqual(self.layout.place(a[16:40]), 16)
+        self.assertEqual(self.layout.used, 64)
+
+    def test_unaligned_match_not_used(self):
+        a = block(1, 64)
+        self.layout.place(a)
+        self.assertEqual(self.layout.place(a[8:24]), 64)
+        self.assertEqual(self.layout.used, 80)
+
+    def test_overlap_with_tail(self):
+        a = block(1, 24)
+        b = a[16:] + block(100, 24)
+        self.layout.place(a)
+        self.assertEqual(self.layout.place(b), 16)
+        self.assertEqual(self.layout.used, 48)
+        self.assertEqual(self.layout.padding, 0)
+        self.assertEqual(bytes(self.layout.data[16:48]), b)
+        self.assertEqual(self.layout.claim(b), 24)
+
+    def test_padding_without_overlap(self):
+        self.layout.place(block(1, 24))
+        self.assertEqual(self.layout.place(block(100, 16)), 32)
+        self.assertEqual(self.layout.padding, 8)
+        self.assertEqual(self.layout.used, 48)
+
+    def test_pack_places_largest_first(self):
+        a = block(1, 96)
+        self.layout.pack([a[32:64], a, a[:32]])
+        self.assertEqual(self.layout.used, 96)
+        self.assertEqual(self.layout.get_pointer(a), 0)
+        self.assertEqual(self.layout.get_pointer(a[32:64]), 2)
+        self.assertEqual(self.layout.get_writes(), [(0, self.layout.data)])
+
+    def test_pack_prefers_overlap_to_padding(self):
+        a = block(1, 40)
+        b = block(200, 32)
+        c = a[32:] + block(50, 8)
+        self.layout.pack([a, b, c])
+        self.assertEqual(self.layout.padding, 0)
+        self.assertEqual(self.layout.place(c), 32)
+
+    def test_report(self):
+        self.layout.place(block(1, 16))
+        self.assertIn('10 bytes used', self.layout.report())
+        self.assertEqual(self.layout.remaining, 0x400 - 16)
+
+
+class TestRerollLayout(unittest.TestCase):
+    def setUp(self):
+        self.data = block(1, 96)
+        self.layout = RerollLayout(0x580000, 0x580080, self.data,
+                                   [(64, 96), (0, 32)])
+
+    def test_gaps(self):
+        self.assertEqual(self.layout.extents, [(0, 32), (64, 96)])
+        self.assertEqual(self.layout.gaps, [(32, 64), (96, 128)])
+
+    def test_reuses_graphics_still_in_use(self):
+        self.assertEqual(self.layout.place(self.data[64:80]), 64)
+        self.assertEqual(self.layout.get_writes(), [])
+        self.assertEqual(self.layout.claim(self.data[64:80]), 0)
+
+    def test_freed_graphics_not_reused(self):
+        freed = self.data[32:48]
+        self.assertEqual(self.layout.place(freed), 32)
+        self.assertEqual(self.layout.get_writes(), [(32, freed)])
+        self.assertEqual(self.layout.claim(freed), 16)
+
+    def test_first_fitting_gap(self):
+        self.assertEqual(self.layout.place(block(150, 16)), 32)
+        self.assertEqual(self.layout.place(block(170, 32)), 96)
+        self.assertEqual(self.layout.place(block(200, 16)), 48)
+        self.assertEqual(self.layout.gaps, [])
+        self.assertEqual([offset for (offset, _) in
+                          self.layout.get_writes()], [32, 96, 48])
+
+    def test_freed_space_remaining(self):
+        self.assertEqual(self.layout.used, 64)
+        self.assertEqual(self.layout.remaining, 64)
+        self.assertEqual(self.layout.padding, 0)
+        self.layout.place(block(150, 24))
+        self.assertEqual(self.layout.used, 96)
+        self.assertEqual(self.layout.remaining, 32)
+        self.assertEqual(self.layout.padding, 8)
+        self.assertIn('60 bytes used', self.layout.report())
+
+    def test_no_gap_fits(self):
+        with self.assertRaises(Exception):
+            self.layout.place(block(150, 48))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+
+from remonsterate.remonsterate import PaletteAllocator
+
+
+def colors(value, length):
+    return [(value + i) & 0x7fff for i in range(length)]
+
+
+class TestPaletteAllocator(unittest.TestCase):
+    def setUp(self):
+        self.allocator = PaletteAllocator(8)
+
+    def test_8color_shared(self):
+        a = colors(1, 8)
+        self.assertIsNone(self.allocator.find(a))
+        index = self.allocator.get_free()
+        self.allocator.add(index, a)
+        self.assertEqual(self.allocator.find(a), index)
+        self.assertIsNone(self.allocator.find(colors(2, 8)))
+        self.assertEqual(self.allocator.shared, 1)
+
+    def test_16color_shared(self):
+        a = colors(1, 16)
+        index = self.allocator.get_free(is_8color=False)
+        self.allocator.add(index, a)
+        self.assertEqual(self.allocator.used, {0, 1})
+        self.assertEqual(self.allocator.find(a), index)
+        self.assertIsNone(self.allocator.find(colors(1, 8) + colors(50, 8)))
+
+    def test_8color_shares_half_of_16color(self):
+        a = colors(1, 16)
+        self.allocator.get_free()
+        index = self.allocator.get_free(is_8color=False)
+        self.allocator.add(index, a)
+        self.assertEqual(self.allocator.find(a[:8]), index)
+        self.assertEqual(self.allocator.find(a[8:]), index + 1)
+        self.assertEqual(self.allocator.remaining, 5)
+
+    def test_first_palette_kept(self):
+        a = colors(1, 8)
+        self.allocator.add(3, a)
+        self.allocator.add(5, a + colors(20, 8))
+        self.assertEqual(self.allocator.find(a), 3)
+
+    def test_get_free_skips_used(self):
+        self.allocator.used.update({1, 3})
+        self.assertEqual(self.allocator.get_free(), 0)
+        self.assertEqual(self.allocator.get_free(), 2)
+        self.assertEqual(self.allocator.get_free(), 4)
+
+    def test_16color_needs_free_successor(self):
+        self.allocator.used.update({1, 5})
+        index = self.allocator.get_free(is_8color=False)
+        self.assertEqual(index, 2)
+        self.allocator.add(index, colors(1, 16))
+        self.assertEqual(self.allocator.get_free(is_8color=False), 6)
+        with self.assertRaises(Exception):
+            self.allocator.get_free(is_8color=False)
+
+    def test_last_index_not_past_capacity(self):
+        self.allocator.used.update(range(7))
+        self.assertFalse(self.allocator.is_free(7, is_8color=False))
+        self.assertTrue(self.allocator.is_free(7))
+        self.assertEqual(self.allocator.get_free(), 7)
+        with self.assertRaises(Exception):
+            self.allocator.get_free()
+
+    def test_report(self):
+        self.allocator.add(self.allocator.get_free(), colors(1, 8))
+        self.allocator.find(colors(1, 8))
+        self.assertEqual(self.allocator.report(),
+                         'Monster palettes: 1 used, 7 remaining, 1 shared.')
+
+
+if __name__ == '__main__':
+    unittest.main()
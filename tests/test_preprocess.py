@@ -0,0 +1,70 @@
+from contextlib import redirect_stdout
+from io import BytesIO, StringIO
+from tempfile import TemporaryDirectory
+from PIL import Image
+import os
+import random
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import make_image, make_pack, make_rom
+from remonsterate.remonsterate import RemonsterSession
+
+
+class TestPreprocess(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = TemporaryDirectory()
+        directory = os.path.join(cls.directory.name, 'pack')
+        cls.images_filename = make_pack(directory, 300, sizes=(16, 32))
+        rng = random.Random(1)
+        invalid = []
+        for i in range(30):
+            if i % 3 == 0:
+                image = make_image(rng, 32, 32, 32)
+            elif i % 3 == 1:
+                image = Image.new('P', (32, 16))
+            else:
+                image = make_image(rng, 160, 32, 8)
+            filename = os.path.join(directory, 'invalid%02d.png' % i)
+            image.save(filename)
+            invalid.append(filename)
+        cls.invalid = set(invalid)
+        with open(cls.images_filename, 'a') as f:
+            f.write('\n'.join(invalid) + '\n')
+        cls.rom = make_rom()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def run_session(self, **kwargs):
+        outfile = BytesIO()
+        with redirect_stdout(StringIO()):
+            session = RemonsterSession.from_files(self.images_filename,
+                                                  **kwargs)
+            manifest = session.run(outfile, 7, rom_type='1.0',
+                                   source=self.rom, log=False)
+        return outfile.getvalue(), manifest
+
+    def test_pool_does_not_change_output(self):
+        rom, manifest = self.run_session()
+        self.assertTrue(manifest['rejected'])
+        for kwargs in [{'processes': 2},
+                       {'processes': 2, 'streaming': True},
+                       {'validate': False}]:
+            pool_rom, pool_manifest = self.run_session(**kwargs)
+            self.assertEqual(pool_rom, rom, kwargs)
+            self.assertEqual(pool_manifest['sprites'], manifest['sprites'])
+
+    def test_invalid_images_not_used(self):
+        _, manifest = self.run_session(processes=2)
+        self.assertEqual(set(manifest['rejected']), self.invalid)
+        used = {sprite['image'] for sprite in manifest['sprites']}
+        self.assertFalse(used & self.invalid)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,104 @@
+from contextlib import redirect_stdout
+from io import BytesIO, StringIO
+from tempfile import TemporaryDirectory
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import make_pack, make_rom
+from remonsterate.remonsterate import RemonsterSession
+
+
+def read_sprites(rom):
+    # (is 8 color, is big, stencil, graphics, colors) for every monster of a
+    # remonstered ROM, read straight from the expanded tables.
+    def word(address):
+        return int.from_bytes(rom[address:address+2], 'little')
+
+    comp8 = 0x5f0000 | word(0x5fa820)
+    comp16 = 0x5f0000 | word(0x5fa822)
+    sprites = []
+    for i in range(0x1a0):
+        entry = rom[0x127000+(i*5):0x127000+(i*5)+5]
+        pointer = entry[0] | (entry[1] << 8)
+        is_8color = bool(pointer & 0x8000)
+        is_big = bool(entry[2] & 0x80)
+        palette = ((entry[2] & 3) << 8) | entry[3]
+        if is_big:
+            data = rom[comp16+(entry[4]*32):comp16+(entry[4]*32)+32]
+            stencil = [int.from_bytes(data[j:j+2], 'little')
+                       for j in range(0, 32, 2)]
+        else:
+            stencil = list(rom[comp8+(entry[4]*8):comp8+(entry[4]*8)+8])
+        num_tiles = sum([bin(v).count('1') for v in stencil])
+        address = 0x580000 + ((pointer & 0x7fff) * 16)
+        graphics = rom[address:address+(num_tiles*(24 if is_8color else 32))]
+        address = 0x5fc000 + (palette * 16)
+        colors = rom[address:address+(16 if is_8color else 32)]
+        sprites.append((is_8color, is_big, stencil, graphics, colors))
+    return sprites
+
+
+class TestReroll(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = TemporaryDirectory()
+        cls.images_filename = make_pack(
+            os.path.join(cls.directory.name, 'pack'), 600, sizes=(16, 32))
+        outfile = BytesIO()
+        session = RemonsterSession.from_files(cls.images_filename)
+        with redirect_stdout(StringIO()):
+            manifest = session.run(outfile, 1, rom_type='1.0',
+                                   source=make_rom(), log=False)
+        cls.rom = outfile.getvalue()
+        cls.images = {sprite['index']: sprite['image']
+                      for sprite in manifest['sprites']}
+        cls.protected = {sprite['index'] for sprite in manifest['sprites']
+                         if sprite['protected']}
+        cls.indexes = [index for index in sorted(cls.images)
+                       if index not in cls.protected][:40:2]
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def reroll(self, images_filename):
+        outfile = BytesIO()
+        session = RemonsterSession.from_files(images_filename)
+        with redirect_stdout(StringIO()) as output:
+            manifest = session.reroll(
+                outfile, 2, self.indexes, manifest=self.images,
+                rom_type='1.0', source=self.rom, log=False,
+                protected=self.protected)
+        images = {sprite['index']: sprite['image']
+                  for sprite in manifest['sprites']}
+        return outfile.getvalue(), images, output.getvalue()
+
+    def test_others_unchanged(self):
+        rom, images, output = self.reroll(self.images_filename)
+        self.assertNotIn('cannot be rerolled', output)
+        before, after = read_sprites(self.rom), read_sprites(rom)
+        for index in range(len(before)):
+            if index in self.indexes:
+                continue
+            self.assertEqual(before[index], after[index], hex(index))
+            self.assertEqual(self.images[index], images[index])
+        self.assertTrue(any([images[index] != self.images[index]
+                             for index in self.indexes]))
+
+    def test_fallback_keeps_image(self):
+        # With only the images already in use, no rerolled monster has a
+        # new candidate, so every one of them keeps its sprite.
+        images_filename = os.path.join(self.directory.name, 'used.txt')
+        with open(images_filename, 'w') as f:
+            f.write('\n'.join(sorted({image for image in self.images.values()
+                                      if image})) + '\n')
+        rom, images, output = self.reroll(images_filename)
+        self.assertEqual(images, self.images)
+        self.assertEqual(read_sprites(rom), read_sprites(self.rom))
+
+
+if __name__ == '__main__':
+    unittest.main()